@@ -0,0 +1,89 @@
+import os
+import threading
+from collections import OrderedDict
+
+from image_cache import image_nbytes
+
+# --- Environment Variables ---
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 96 * 1024 * 1024))
+
+def collapse_adjustments(adjustments):
+    """Merges consecutive steps of the same tool into one net step.
+
+    Steps that cancel out are dropped, which can in turn make their
+    neighbours consecutive: brightness +1, contrast +1, contrast -1,
+    brightness +1 collapses to a single brightness +2.
+    """
+    collapsed = []
+    for adj in adjustments:
+        if collapsed and collapsed[-1][0] == adj['tool']:
+            net = collapsed[-1][1] + adj['value']
+            collapsed.pop()
+        else:
+            net = adj['value']
+        if net:
+            collapsed.append((adj['tool'], net))
+    return tuple(collapsed)
+
+class AdjustmentEngine:
+    """Renders adjustment lists incrementally from cached intermediate states.
+
+    Every rendered state of a session's collapsed adjustment list is kept in
+    a byte-bounded LRU. A render starts from the longest cached prefix and
+    hands the remaining steps to render_fn in one call, so a new step, an
+    undo or a reset costs at most one render (or none on a hit).
+    """
+
+    def __init__(self, render_fn, max_bytes=RENDER_CACHE_MAX_BYTES):
+        self.render_fn = render_fn
+        self.max_bytes = max_bytes
+        self._states = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'steps_rendered': 0}
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._states.get(key)
+            if entry is None:
+                return None
+            self._states.move_to_end(key)
+            return entry[0]
+
+    def _put(self, key, image):
+        size = image_nbytes(image)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._states.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._states[key] = (image, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._states.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def render(self, session_key, original_image, adjustments):
+        """Returns original_image with the adjustments applied (read-only, may be cached)."""
+        steps = collapse_adjustments(adjustments)
+        start, image = 0, original_image
+        for k in range(len(steps), 0, -1):
+            cached = self._get((session_key, steps[:k]))
+            if cached is not None:
+                start, image = k, cached
+                break
+        with self._lock:
+            self.counters['hits' if start == len(steps) else 'misses'] += 1
+            self.counters['steps_rendered'] += len(steps) - start
+        if start < len(steps):
+            image = self.render_fn(image, steps[start:])
+            self._put((session_key, steps), image)
+        return image
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self._states)
+            stats['bytes'] = self._bytes
+        return stats
@@ -0,0 +1,271 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+from storage import get_storage
+
+# --- Environment Variables ---
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', 25))  # Messages per second, across all workers
+BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', 8))
+
+# --- Constants ---
+JOB_KIND = 'broadcast'
+FLUSH_EVERY = 50  # Recipient statuses written per storage write
+LEASE_SECONDS = 60  # A runner that has not renewed its lease for this long is presumed dead
+LEASE_RENEW_EVERY = LEASE_SECONDS / 3
+MAX_ATTEMPTS = 3
+RESUME_CHECK_INTERVAL = 30
+
+# Per-recipient statuses
+PENDING, SENT, BLOCKED, FAILED = 'pending', 'sent', 'blocked', 'failed'
+
+def _recipients_kind(job_id):
+    return f"broadcast:{job_id}"
+
+class TokenBucket:
+    """Global messages-per-second limiter shared by all delivery workers."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.paused_until - now
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Stops every worker for `seconds`, e.g. after Telegram answered 429."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated = self.paused_until
+
+# --- Jobs ---
+def create_job(text, admin_chat_id):
+    """Persists a new broadcast job with every current user as a pending recipient."""
+    storage = get_storage()
+    job_id = uuid.uuid4().hex[:8]
+    recipients = storage.iter_user_ids()
+    storage.put_records(_recipients_kind(job_id), {uid: PENDING for uid in recipients})
+    storage.put_record(JOB_KIND, job_id, {
+        'text': text, 'admin_chat_id': admin_chat_id, 'total': len(recipients),
+        'status': 'running', 'created_at': time.time(), 'lease_until': 0,
+    })
+    return job_id
+
+def latest_job_id():
+    jobs = get_storage().iter_records(JOB_KIND)
+    if not jobs:
+        return None
+    return max(jobs, key=lambda item: item[1].get('created_at', 0))[0]
+
+def job_progress(job_id):
+    """Returns (job, {status: count}) or (None, None) for an unknown job.
+
+    Finished jobs keep their final counts on the job record; their
+    per-recipient records are deleted.
+    """
+    storage = get_storage()
+    job = storage.get_record(JOB_KIND, job_id)
+    if job is None:
+        return None, None
+    if 'counts' in job:
+        return job, job['counts']
+    return job, _count(storage.iter_records(_recipients_kind(job_id)))
+
+def _count(recipients):
+    counts = {PENDING: 0, SENT: 0, BLOCKED: 0, FAILED: 0}
+    for _, status in recipients:
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+# --- Delivery ---
+def _deliver(job, user_id, bucket):
+    """Sends one message, waiting out 429s globally. Returns the recipient status."""
+    payload = {'chat_id': user_id, 'text': job['text'], 'parse_mode': 'Markdown'}
+    for attempt in range(MAX_ATTEMPTS):
+        bucket.acquire()
+        try:
+            response = http_client.telegram('sendMessage', json=payload, retries=0)
+        except Exception as e:
+            print(f"Broadcast በመላክ ላይ ስህተት ({user_id}): {e}")
+            continue
+        if response.ok:
+            return SENT
+        if response.status_code == 429:
+            bucket.pause(http_client.retry_after(response) or 1)
+            continue
+        if response.status_code == 403:
+            return BLOCKED  # Blocked the bot or deactivated
+        if response.status_code < 500:
+            return FAILED
+    return FAILED
+
+class _Runner:
+    """Delivers one job on a background thread while it holds the job's lease.
+
+    The lease is the job's 'runner' token plus 'lease_until'. It is taken and
+    renewed with a compare-and-set on the token, so only one runner holds it
+    at a time. It is renewed on a timer, so slow sends or a 429 pause do not
+    let it lapse. Before each batch the runner re-reads the job and stops if
+    its token was replaced, and it sends nothing once its own lease has run
+    out, e.g. after its instance was frozen and another one resumed the job.
+
+    Every write is preceded by storage.refresh(): the JSONBin backend keeps
+    the document it loaded in memory, and writing back a copy from before
+    other instances' changes would undo them.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.token = uuid.uuid4().hex
+        self.storage = get_storage()
+        self.lease_until = 0.0
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def _write_job(self, **fields):
+        """Writes the job if this runner still holds it. Returns the written job, or None."""
+        self.storage.refresh()
+        current = self.storage.get_record(JOB_KIND, self.job_id)
+        if current is None or current.get('runner') != self.token:
+            return None
+        current.update(fields)
+        if not self.storage.update_record_if(JOB_KIND, self.job_id, 'runner', self.token, current):
+            return None
+        return current
+
+    def _take_lease(self):
+        self.storage.refresh()
+        job = self.storage.get_record(JOB_KIND, self.job_id)
+        now = time.time()
+        if job is None or job['status'] != 'running' or job.get('lease_until', 0) >= now:
+            return None
+        lease_until = now + LEASE_SECONDS
+        taken = dict(job, runner=self.token, lease_until=lease_until)
+        if not self.storage.update_record_if(JOB_KIND, self.job_id, 'runner', job.get('runner'), taken):
+            return None  # Another instance took it first
+        self.lease_until = lease_until
+        return taken
+
+    def _renew_lease(self):
+        lease_until = time.time() + LEASE_SECONDS
+        with self.lock:
+            if self._write_job(lease_until=lease_until) is None:
+                self.stopped.set()
+                return False
+            self.lease_until = lease_until
+            return True
+
+    def _keep_lease(self):
+        while not self.stopped.wait(LEASE_RENEW_EVERY):
+            try:
+                self._renew_lease()
+            except Exception as e:
+                print(f"Broadcast lease ላይ ስህተት ({self.job_id}): {e}")
+
+    def _holds_lease(self):
+        """Cheap check before every send: the last renewal has not run out."""
+        return not self.stopped.is_set() and time.time() < self.lease_until
+
+    def _deliver(self, job, user_id, bucket):
+        if not self._holds_lease():
+            return None
+        return _deliver(job, user_id, bucket)
+
+    def run(self):
+        job = self._take_lease()
+        if job is None:
+            return
+        threading.Thread(target=self._keep_lease, daemon=True).start()
+        try:
+            self._deliver_pending(job)
+        finally:
+            self.stopped.set()
+
+    def _deliver_pending(self, job):
+        pending = [uid for uid, status in self.storage.iter_records(_recipients_kind(self.job_id)) if status == PENDING]
+        bucket = TokenBucket(BROADCAST_RATE)
+        with ThreadPoolExecutor(max_workers=BROADCAST_CONCURRENCY) as pool:
+            for start in range(0, len(pending), FLUSH_EVERY):
+                # Re-read the job: another runner may have taken it over.
+                if not self._renew_lease():
+                    return
+                batch = pending[start:start + FLUSH_EVERY]
+                statuses = pool.map(lambda uid: self._deliver(job, uid, bucket), batch)
+                results = {uid: status for uid, status in zip(batch, statuses) if status is not None}
+                if results:
+                    self.storage.refresh()
+                    self.storage.put_records(_recipients_kind(self.job_id), results)
+                if len(results) < len(batch):
+                    return  # The lease ran out mid-batch
+
+        # Keep the final counts on the job and drop the per-recipient records,
+        # which would otherwise stay in storage (on JSONBin, in every download).
+        self.storage.refresh()
+        recipients = self.storage.iter_records(_recipients_kind(self.job_id))
+        counts = _count(recipients)
+        with self.lock:
+            job = self._write_job(status='done', finished_at=time.time(), counts=counts)
+        if job is None:
+            return
+        self.storage.delete_records(_recipients_kind(self.job_id), [uid for uid, _ in recipients])
+        summary = f"✅ መልዕክቱ ለ *{counts[SENT]}* ከ *{job['total']}* ተጠቃሚዎች ተልኳል።"
+        if counts[BLOCKED]:
+            summary += f"\n🚫 ቦቱን ያገዱ: *{counts[BLOCKED]}*"
+        http_client.telegram('sendMessage', json={'chat_id': job['admin_chat_id'], 'text': summary, 'parse_mode': 'Markdown'})
+
+_active = set()
+_active_lock = threading.Lock()
+_last_resume_check = 0.0
+
+def start_job(job_id):
+    """Delivers a job on a background thread unless this process is already running it."""
+    with _active_lock:
+        if job_id in _active:
+            return
+        _active.add(job_id)
+
+    def target():
+        try:
+            _Runner(job_id).run()
+        except Exception as e:
+            print(f"Broadcast ስራ ላይ ስህተት ({job_id}): {e}")
+        finally:
+            with _active_lock:
+                _active.discard(job_id)
+
+    threading.Thread(target=target, daemon=True).start()
+
+def resume_interrupted_jobs():
+    """Restarts running jobs whose runner stopped (e.g. a frozen or recycled instance).
+
+    Cheap to call on every update: it only looks at storage every
+    RESUME_CHECK_INTERVAL seconds.
+    """
+    global _last_resume_check
+    now = time.time()
+    if now - _last_resume_check < RESUME_CHECK_INTERVAL:
+        return
+    _last_resume_check = now
+    for job_id, job in get_storage().iter_records(JOB_KIND):
+        if job.get('status') == 'running' and job.get('lease_until', 0) < now:
+            start_job(job_id)
@@ -0,0 +1,203 @@
+import functools
+from PIL import Image, ImageOps, ImageEnhance, ImageFilter, ImageStat
+
+# Fused colour engine.
+#
+# Every adjustment and filter is described as a list of primitive steps.
+# A program made of per-channel steps only (brightness, warmth, contrast)
+# compiles to one 768-entry lookup table applied with Image.point(); any
+# program that mixes channels (saturation, tints, grayscale) compiles to a
+# single affine colour matrix applied with Image.convert(). Either way the
+# colour work is one C-level pass over the pixels instead of one pass per
+# step. Convolutions (sharpness, SHARPEN) always come last and run after it.
+#
+# Tolerance versus the chained PIL path (render_chained): the LUT path is
+# within 2 levels per pixel, since its contrast means come from the
+# histogram. The matrix path is within a mean absolute difference of 2
+# levels per channel: it skips the clipping the chained path does between
+# steps and rounds once instead of per step, so only pixels pushed out of
+# range mid-chain differ by more. tools/bench_color_engine.py reports both
+# numbers.
+
+LUMA = (0.299, 0.587, 0.114)
+STATS_SIZE = 128  # Long edge of the thumbnail used to estimate contrast means
+PER_CHANNEL_OPS = ('brightness', 'contrast', 'warmth')
+CONVOLUTION_OPS = ('sharpness', 'sharpen')
+# Pixels each convolution reads beyond the one it writes (SHARPEN and the
+# SMOOTH kernel behind Sharpness are both 3x3).
+CONVOLUTION_RADIUS = {'sharpness': 1, 'sharpen': 1}
+
+FILTER_STEPS = {
+    'saturate': (('color', 1.5),),
+    'enhance': (('contrast', 1.4), ('color', 1.2), ('sharpness', 1.3)),
+    'dynamic': (('contrast', 1.5), ('sharpen', None)),
+    'airy': (('brightness', 1.2), ('color', 0.8)),
+    'cinematic': (('color', 0.6), ('contrast', 1.4), ('tint', ((0x00, 0x11, 0x22), 0.2))),
+    'noir': (('grayscale', None), ('contrast', 1.8)),
+}
+
+def adjustment_steps(tool, value):
+    """Primitive steps for one +/- adjustment of the given tool."""
+    if tool in ('brightness', 'shadow'):
+        return (('brightness', 1 + 0.1 * value),)
+    elif tool == 'contrast':
+        return (('contrast', 1 + 0.1 * value),)
+    elif tool == 'saturation':
+        return (('color', 1 + 0.2 * value),)
+    elif tool == 'warmth':
+        return (('warmth', value),)
+    return ()
+
+# --- Reference (chained) implementation ---
+def _apply_step_chained(image, op, arg):
+    if op == 'brightness':
+        return ImageEnhance.Brightness(image).enhance(arg)
+    elif op == 'contrast':
+        return ImageEnhance.Contrast(image).enhance(arg)
+    elif op == 'color':
+        return ImageEnhance.Color(image).enhance(arg)
+    elif op == 'warmth':
+        if image.mode != 'RGB':
+            return image
+        r, g, b = image.split()
+        r = r.point(lambda i: i * (1 + 0.05 * arg))
+        b = b.point(lambda i: i * (1 - 0.05 * arg))
+        return Image.merge('RGB', (r, g, b))
+    elif op == 'tint':
+        colour, alpha = arg
+        return Image.blend(image, Image.new(image.mode, image.size, colour if image.mode == 'RGB' else colour[0]), alpha=alpha)
+    elif op == 'grayscale':
+        return ImageOps.grayscale(image)
+    elif op == 'sharpness':
+        return ImageEnhance.Sharpness(image).enhance(arg)
+    elif op == 'sharpen':
+        return image.filter(ImageFilter.SHARPEN)
+    return image
+
+def render_chained(image, steps):
+    """Applies steps one full-image PIL pass at a time (the original behaviour)."""
+    for op, arg in steps:
+        image = _apply_step_chained(image, op, arg)
+    return image
+
+# --- Compiled programs ---
+class ColorProgram:
+    """A compiled list of primitive steps, reusable across images."""
+
+    def __init__(self, steps):
+        self.steps = tuple(steps)
+        split = len(self.steps)
+        while split and self.steps[split - 1][0] in CONVOLUTION_OPS:
+            split -= 1
+        self.colour_steps = self.steps[:split]
+        self.convolution_steps = self.steps[split:]
+        # A convolution in the middle of the chain cannot be fused.
+        self.fusable = not any(op in CONVOLUTION_OPS for op, _ in self.colour_steps)
+        self.per_channel = all(op in PER_CHANNEL_OPS for op, _ in self.colour_steps)
+        # Border a crop needs so its interior matches the same area of a full render.
+        self.halo = sum(CONVOLUTION_RADIUS[op] for op, _ in self.convolution_steps)
+
+    def render(self, image):
+        """Returns a new image with the program applied; the input is not modified."""
+        if not self.fusable or image.mode != 'RGB':
+            return render_chained(image, self.steps)
+        return render_plan(image, self.plan(image), self.convolution_steps)
+
+    def plan(self, image):
+        """The colour pass for an RGB image: ('point', table), ('convert', mode, matrix) or None.
+
+        Its parameters come from the whole image, so applying the plan to any
+        crop gives the same pixels as the matching area of a full render.
+        """
+        if not self.colour_steps:
+            return None
+        elif self.per_channel:
+            return ('point', self.build_lut(image))
+        return ('convert',) + self.build_matrix(image)
+
+    # --- LUT path (exact per-step clipping and rounding) ---
+    def build_lut(self, image):
+        """Composes the per-channel steps into one 768-entry table for this image."""
+        histograms = image.histogram()
+        tables = [list(range(256)) for _ in range(3)]
+        for op, arg in self.colour_steps:
+            if op == 'brightness':
+                tables = [[_clip_trunc(v * arg) for v in t] for t in tables]
+            elif op == 'contrast':
+                channel_means = [_table_mean(t, histograms[256 * c:256 * (c + 1)]) for c, t in enumerate(tables)]
+                mean = int(sum(w * m for w, m in zip(LUMA, channel_means)) + 0.5)
+                tables = [[_clip_trunc(mean + arg * (v - mean)) for v in t] for t in tables]
+            elif op == 'warmth':
+                tables[0] = [_clip_round(v * (1 + 0.05 * arg)) for v in tables[0]]
+                tables[2] = [_clip_round(v * (1 - 0.05 * arg)) for v in tables[2]]
+        return tables[0] + tables[1] + tables[2]
+
+    # --- Matrix path ---
+    def _contrast_means(self, image):
+        """Estimates the grey level PIL's Contrast would use before each contrast step."""
+        if not any(op == 'contrast' for op, _ in self.colour_steps):
+            return []
+        thumb = image
+        factor = max(1, max(image.size) // STATS_SIZE)
+        if factor > 1:
+            thumb = image.reduce(factor)
+        means = []
+        for op, arg in self.colour_steps:
+            if op == 'contrast':
+                means.append(int(ImageStat.Stat(thumb.convert('L')).mean[0] + 0.5))
+            thumb = _apply_step_chained(thumb, op, arg)
+        return means
+
+    def build_matrix(self, image):
+        """Composes the colour steps of an RGB image into (output_mode, affine matrix)."""
+        means = iter(self._contrast_means(image))
+        # Rows of [a_r, a_g, a_b, offset]; one row per output channel.
+        rows = [[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0]]
+        for op, arg in self.colour_steps:
+            if op == 'brightness':
+                rows = [[x * arg for x in row] for row in rows]
+            elif op == 'contrast':
+                mean = next(means)
+                rows = [[x * arg for x in row[:3]] + [row[3] * arg + (1 - arg) * mean] for row in rows]
+            elif op == 'color' and len(rows) == 3:
+                luma_row = [sum(LUMA[c] * rows[c][k] for c in range(3)) for k in range(4)]
+                rows = [[arg * row[k] + (1 - arg) * luma_row[k] for k in range(4)] for row in rows]
+            elif op == 'warmth' and len(rows) == 3:
+                rows[0] = [x * (1 + 0.05 * arg) for x in rows[0]]
+                rows[2] = [x * (1 - 0.05 * arg) for x in rows[2]]
+            elif op == 'tint':
+                colour, alpha = arg
+                rows = [[x * (1 - alpha) for x in row[:3]] + [row[3] * (1 - alpha) + alpha * colour[c]] for c, row in enumerate(rows)]
+            elif op == 'grayscale' and len(rows) == 3:
+                rows = [[sum(LUMA[c] * rows[c][k] for c in range(3)) for k in range(4)]]
+        mode = 'RGB' if len(rows) == 3 else 'L'
+        return mode, tuple(x for row in rows for x in row)
+
+def render_plan(image, plan, convolution_steps):
+    """Applies a colour plan from ColorProgram.plan() and then the convolutions."""
+    if plan is None:
+        out = image.copy()
+    elif plan[0] == 'point':
+        out = image.point(plan[1])
+    else:
+        out = image.convert(plan[1], plan[2])
+    return render_chained(out, convolution_steps)
+
+def _clip_trunc(v):
+    return 0 if v <= 0 else 255 if v >= 255 else int(v)
+
+def _clip_round(v):
+    return 0 if v <= 0 else 255 if v >= 255 else int(v + 0.5)
+
+def _table_mean(table, histogram):
+    total = sum(histogram)
+    return sum(table[i] * n for i, n in enumerate(histogram)) / total if total else 0.0
+
+@functools.lru_cache(maxsize=512)
+def compile_program(adjustments=(), filter_type=None):
+    """Compiles (tool, value) adjustments followed by an optional filter into a ColorProgram."""
+    steps = []
+    for tool, value in adjustments:
+        steps.extend(adjustment_steps(tool, value))
+    steps.extend(FILTER_STEPS.get(filter_type, ()))
+    return ColorProgram(steps)
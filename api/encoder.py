@@ -0,0 +1,160 @@
+import io
+import os
+import time
+import threading
+from PIL import Image, features
+
+from tracing import span
+
+# --- Environment Variables ---
+PREVIEW_FORMAT = os.environ.get('PREVIEW_FORMAT', 'JPEG').upper()  # JPEG or WEBP
+PREVIEW_QUALITY = int(os.environ.get('PREVIEW_QUALITY', 80))
+PREVIEW_MAX_BYTES = int(os.environ.get('PREVIEW_MAX_BYTES', 0))  # 0 = no byte budget
+FINAL_QUALITY = int(os.environ.get('FINAL_QUALITY', 95))
+FINAL_SUBSAMPLING = os.environ.get('FINAL_SUBSAMPLING', '4:2:0')
+# Progressive JPEGs come out ~1% smaller than optimized baseline ones but take ~2x longer to encode.
+FINAL_PROGRESSIVE = os.environ.get('FINAL_PROGRESSIVE') == '1'
+# Telegram rejects photos over 10 MB, so finals are always kept under it.
+FINAL_MAX_BYTES = int(os.environ.get('FINAL_MAX_BYTES', 10 * 1024 * 1024))
+
+# --- Constants ---
+MIN_QUALITY = 40  # Lowest quality the byte-budget search will go to
+EXIF_ORIENTATION = 0x0112
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+# ICC colour space signature (header bytes 16-20) that each image mode needs.
+ICC_COLOUR_SPACES = {'RGB': b'RGB ', 'RGBA': b'RGB ', 'L': b'GRAY', 'LA': b'GRAY'}
+
+PROFILES = {
+    # Previews are re-encoded on every button press: favour encode speed.
+    'preview': {'format': PREVIEW_FORMAT, 'quality': PREVIEW_QUALITY, 'max_bytes': PREVIEW_MAX_BYTES,
+                'optimize': False, 'progressive': False, 'subsampling': '4:2:0', 'webp_method': 2},
+    # Finals are encoded once: optimized Huffman tables make them ~5% smaller.
+    'final': {'format': 'JPEG', 'quality': FINAL_QUALITY, 'max_bytes': FINAL_MAX_BYTES,
+              'optimize': True, 'progressive': FINAL_PROGRESSIVE, 'subsampling': FINAL_SUBSAMPLING, 'webp_method': 4},
+}
+
+def metadata(source, image):
+    """The ICC profile and EXIF orientation of a decoded original, as save() keyword arguments.
+
+    Only the orientation tag is kept from the EXIF block, so location and
+    camera data are not passed on. The profile is dropped when it does not
+    describe the output's colour space (e.g. an RGB profile on the grayscale
+    'noir' output), which colour-managed decoders reject.
+    """
+    params = {}
+    if source is None:
+        return params
+    icc_profile = source.info.get('icc_profile')
+    if icc_profile and icc_profile[16:20] == ICC_COLOUR_SPACES.get(image.mode):
+        params['icc_profile'] = icc_profile
+    orientation = source.getexif().get(EXIF_ORIENTATION)
+    if orientation and orientation != 1:
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION] = orientation
+        params['exif'] = exif.tobytes()
+    return params
+
+class Encoder:
+    """Encodes rendered images for upload according to a named profile."""
+
+    def __init__(self, profiles=PROFILES):
+        self.profiles = profiles
+        self.webp = features.check('webp')
+        self.counters = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _buffer(self):
+        """This thread's output buffer, reused across calls to avoid reallocating it."""
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = self._local.buffer = io.BytesIO()
+        buffer.seek(0)
+        buffer.truncate()
+        return buffer
+
+    def _save(self, image, out, image_format, quality, profile, extra, probe=False):
+        """Encodes into out and returns the size. A probe skips the slow size optimizations,
+        so it is quicker and almost always at least as large as the real encode."""
+        out.seek(0)
+        out.truncate()
+        if image_format == 'WEBP':
+            image.save(out, format='WEBP', quality=quality, method=0 if probe else profile['webp_method'], **extra)
+        else:
+            image.save(out, format='JPEG', quality=quality, optimize=profile['optimize'] and not probe,
+                       progressive=profile['progressive'] and not probe, subsampling=profile['subsampling'], **extra)
+        return out.tell()
+
+    def encode(self, image, profile='final', source=None, out=None):
+        """Encodes image and returns (buffer, info), with the buffer rewound to the start.
+
+        source is the decoded original whose ICC profile and EXIF orientation
+        are carried over. Unless out is given, the buffer is this thread's
+        reusable one and is only valid until the thread's next encode.
+        When the profile has max_bytes and the first encode is over it,
+        quality is binary-searched down to MIN_QUALITY for the highest
+        quality that fits. info has format, mime_type, filename, quality,
+        bytes, attempts and seconds.
+        """
+        settings = self.profiles[profile]
+        image_format = settings['format']
+        if image_format == 'WEBP' and not self.webp:
+            image_format = 'JPEG'
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        extra = metadata(source, image)
+        out = out if out is not None else self._buffer()
+        max_bytes = settings['max_bytes']
+        quality = settings['quality']
+        start = time.perf_counter()
+        with span('encode', profile=profile, format=image_format) as current:
+            size = self._save(image, out, image_format, quality, settings, extra)
+            attempts = 1
+            if max_bytes and size > max_bytes:
+                # Search with quick probe encodes, then encode the chosen quality for real.
+                low, high, best = MIN_QUALITY, quality - 1, None
+                while low <= high:
+                    middle = (low + high) // 2
+                    attempts += 1
+                    if self._save(image, out, image_format, middle, settings, extra, probe=True) <= max_bytes:
+                        best, low = middle, middle + 1
+                    else:
+                        high = middle - 1
+                quality = best if best is not None else MIN_QUALITY
+                size = self._save(image, out, image_format, quality, settings, extra)
+                attempts += 1
+                if size > max_bytes and best is not None:
+                    # The optimizations backfired; the probe encode is known to fit.
+                    size = self._save(image, out, image_format, quality, settings, extra, probe=True)
+                    attempts += 1
+            current.set(quality=quality, bytes=size, attempts=attempts)
+        seconds = time.perf_counter() - start
+        out.seek(0)
+        self._record(profile, size, seconds, attempts)
+        info = {'format': image_format, 'mime_type': MIME_TYPES[image_format],
+                'filename': f"edited_image.{EXTENSIONS[image_format]}", 'quality': quality,
+                'bytes': size, 'attempts': attempts, 'seconds': seconds}
+        return out, info
+
+    def _record(self, profile, size, seconds, attempts):
+        with self._lock:
+            counters = self.counters.setdefault(profile, {'calls': 0, 'bytes': 0, 'seconds': 0.0, 'budget_retries': 0})
+            counters['calls'] += 1
+            counters['bytes'] += size
+            counters['seconds'] += seconds
+            counters['budget_retries'] += attempts - 1
+
+    def stats(self):
+        """Calls, bytes, seconds and byte-budget re-encodes per profile, with per-call averages."""
+        stats = {}
+        with self._lock:
+            for profile, counters in self.counters.items():
+                for name, value in counters.items():
+                    stats[f"{profile}_{name}"] = value
+                stats[f"{profile}_avg_bytes"] = counters['bytes'] / counters['calls']
+                stats[f"{profile}_avg_ms"] = counters['seconds'] * 1000 / counters['calls']
+        return stats
+
+# Shared by all requests handled by this process.
+encoder = Encoder()
@@ -0,0 +1,147 @@
+import os
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from tracing import span, record_bytes
+
+# --- Environment Variables ---
+TOKEN = os.environ.get('TELEGRAM_TOKEN')
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+JSONBIN_API_URL = os.environ.get('JSONBIN_API_URL', 'https://api.jsonbin.io')
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 3))
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 32))
+
+# --- Constants ---
+CONNECT_TIMEOUT = 3.05
+# Read timeouts per endpoint (a Telegram method name, 'download' or 'jsonbin').
+READ_TIMEOUTS = {
+    'default': 10,
+    'getFile': 10,
+    'download': 30,
+    'sendPhoto': 60,
+    'editMessageMedia': 60,
+    'sendMediaGroup': 120,
+    'jsonbin': 15,
+}
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8
+MAX_RETRY_AFTER = 30  # Longer waits are returned to the caller instead of slept through
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Returns the process-wide pooled session, so warm invocations reuse connections."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+def timeout_for(endpoint):
+    return (CONNECT_TIMEOUT, READ_TIMEOUTS.get(endpoint, READ_TIMEOUTS['default']))
+
+def retry_after(response):
+    """Seconds to wait before retrying, from Telegram's retry_after or a Retry-After header."""
+    try:
+        value = response.json().get('parameters', {}).get('retry_after')
+        if value is not None:
+            return float(value)
+    except ValueError:
+        pass
+    header = response.headers.get('Retry-After')
+    if header and header.isdigit():
+        return float(header)
+    return None
+
+def _backoff(attempt):
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * (0.5 + random.random() / 2)
+
+def _rewind(files):
+    """Seeks file objects back to the start so a retried upload sends the whole body."""
+    for value in (files or {}).values():
+        fileobj = value[1] if isinstance(value, tuple) else value
+        if hasattr(fileobj, 'seek'):
+            fileobj.seek(0)
+
+def request(method, url, endpoint='default', retries=HTTP_MAX_RETRIES, **kwargs):
+    """Sends a request through the pooled session.
+
+    429 and 5xx responses are retried with exponential backoff (or after
+    Telegram's retry_after). Read timeouts and dropped connections are only
+    retried for GET, since a POST may already have been applied; other
+    methods retry only failures to connect, when nothing was sent. After
+    the last attempt the response (or exception) is returned (or raised)
+    as-is.
+    """
+    kwargs.setdefault('timeout', timeout_for(endpoint))
+    with span(f"http.{endpoint}") as current:
+        response = _request_with_retries(method, url, retries, current, **kwargs)
+        current.set(status=response.status_code)
+        record_bytes('out', endpoint, _body_size(response.request.body))
+        if not kwargs.get('stream'):
+            record_bytes('in', endpoint, len(response.content))
+        return response
+
+def _body_size(body):
+    return len(body) if isinstance(body, (bytes, str)) else 0
+
+def _nothing_sent(error):
+    """Whether a connection error happened before the request reached the server."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)  # e.g. connection refused
+
+def _request_with_retries(method, url, retries, current, **kwargs):
+    session = get_session()
+    for attempt in range(retries + 1):
+        current.set(attempts=attempt + 1)
+        _rewind(kwargs.get('files'))
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.exceptions.ConnectionError as e:
+            # "Connection aborted" after the body was sent is a ConnectionError too.
+            if attempt == retries or (method.upper() != 'GET' and not _nothing_sent(e)):
+                raise
+            delay = _backoff(attempt)
+        except requests.exceptions.Timeout:
+            if attempt == retries or method.upper() != 'GET':
+                raise
+            delay = _backoff(attempt)
+        else:
+            if response.status_code != 429 and response.status_code < 500 or attempt == retries:
+                return response
+            delay = retry_after(response)
+            if delay is None:
+                delay = _backoff(attempt)
+            elif delay > MAX_RETRY_AFTER:
+                return response
+            response.close()
+        time.sleep(delay)
+
+# --- Telegram ---
+def telegram_url(method):
+    return f"{TELEGRAM_API_URL}/bot{TOKEN}/{method}"
+
+def telegram_file_url(file_path):
+    return f"{TELEGRAM_API_URL}/file/bot{TOKEN}/{file_path}"
+
+def telegram(method, http_method='POST', **kwargs):
+    """Calls a Bot API method, e.g. telegram('sendMessage', json={...})."""
+    return request(http_method, telegram_url(method), endpoint=method, **kwargs)
+
+# --- JSONBin ---
+def jsonbin_url(bin_id, latest=False):
+    return f"{JSONBIN_API_URL}/v3/b/{bin_id}" + ('/latest' if latest else '')
+
+def jsonbin(http_method, url, **kwargs):
+    return request(http_method, url, endpoint='jsonbin', **kwargs)
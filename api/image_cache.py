@@ -0,0 +1,151 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+# --- Environment Variables ---
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 128 * 1024 * 1024))
+IMAGE_CACHE_DISK_DIR = os.environ.get('IMAGE_CACHE_DISK_DIR', '/tmp/photo_bot_cache')  # Empty disables the disk tier
+IMAGE_CACHE_DISK_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_DISK_MAX_BYTES', 512 * 1024 * 1024))
+FILE_PATH_CACHE_SIZE = 4096
+
+def image_nbytes(image):
+    """Approximate in-memory size of a decoded PIL image."""
+    return image.width * image.height * len(image.getbands())
+
+class ImageCache:
+    """Bounded cache for Telegram originals.
+
+    Decoded images live in an in-process LRU bounded by their pixel size.
+    The downloaded (still encoded) bytes are also kept on disk so that warm
+    serverless instances sharing /tmp can skip the download. Cached images
+    are shared between requests and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes=IMAGE_CACHE_MAX_BYTES, disk_dir=IMAGE_CACHE_DISK_DIR, disk_max_bytes=IMAGE_CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._images = OrderedDict()
+        self._file_paths = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {
+            'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0,
+            'file_path_hits': 0, 'file_path_misses': 0, 'file_path_drops': 0,
+        }
+
+    # --- Decoded image tier ---
+    def get(self, key):
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is None:
+                return None
+            self._images.move_to_end(key)
+            self.counters['memory_hits'] += 1
+            return entry[0]
+
+    def put(self, key, image):
+        size = image_nbytes(image)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._images.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._images[key] = (image, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._images.popitem(last=False)
+                self._bytes -= evicted_size
+                self.counters['evictions'] += 1
+
+    # --- Encoded bytes tier (disk) ---
+    def _disk_path(self, file_id):
+        return os.path.join(self.disk_dir, hashlib.sha1(file_id.encode()).hexdigest())
+
+    def get_bytes(self, file_id):
+        """Returns the encoded original from disk, counting a miss if it is absent."""
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(file_id), 'rb') as f:
+                    data = f.read()
+                with self._lock:
+                    self.counters['disk_hits'] += 1
+                return data
+            except OSError:
+                pass
+        with self._lock:
+            self.counters['misses'] += 1
+        return None
+
+    def put_bytes(self, file_id, data):
+        if not self.disk_dir or len(data) > self.disk_max_bytes:
+            return
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            path = self._disk_path(file_id)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)  # Atomic, so concurrent readers never see a partial file
+            self._trim_disk()
+        except OSError as e:
+            print(f"Image cache በመጻፍ ላይ ስህተት: {e}")
+
+    def _trim_disk(self):
+        """Removes the least recently written files once the disk tier is over budget."""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.disk_dir):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.disk_max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.disk_max_bytes:
+                break
+
+    # --- getFile results ---
+    def get_file_path(self, file_id):
+        with self._lock:
+            file_path = self._file_paths.get(file_id)
+            if file_path is None:
+                self.counters['file_path_misses'] += 1
+                return None
+            self._file_paths.move_to_end(file_id)
+            self.counters['file_path_hits'] += 1
+            return file_path
+
+    def put_file_path(self, file_id, file_path):
+        with self._lock:
+            self._file_paths[file_id] = file_path
+            self._file_paths.move_to_end(file_id)
+            if len(self._file_paths) > FILE_PATH_CACHE_SIZE:
+                self._file_paths.popitem(last=False)
+
+    def drop_file_path(self, file_id):
+        """Forgets a file_path whose download failed; Telegram's download links expire after an hour."""
+        with self._lock:
+            if self._file_paths.pop(file_id, None) is not None:
+                self.counters['file_path_drops'] += 1
+
+    def stats(self):
+        """Returns the hit/miss counters plus current occupancy."""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self._images)
+            stats['memory_bytes'] = self._bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['network_skip_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+# Shared by all requests handled by this process.
+original_cache = ImageCache()
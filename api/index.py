@@ -1,10 +1,27 @@
 import os
-import requests
-from flask import Flask, request
-from PIL import Image, ImageOps, ImageEnhance, ImageFilter
-import io
-import json
+import sys
 import time
+import uuid
+from flask import Flask, request
+import threading
+
+# Sibling modules live next to this file; make them importable however the app is loaded.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import broadcast
+import ingest
+from tracing import span, metrics, begin_trace, end_trace
+from update_queue import LocalUpdateQueue, SeenWindow
+from storage import get_storage
+from media_cache import media_cache, state_id
+import recipes
+import sessions
+from menus import (CREDITS_FOR_ADDING_MEMBERS, MEMBERS_TO_ADD, START_MENU, ADJUST_MENU,
+                   get_adjust_submenu, get_album_menu, get_session_view)
+from telegram_api import send_telegram_message, answer_callback_query, edit_message_reply_markup, edit_message_caption, send_or_edit_photo
+
+# This module is the dispatch core: it parses updates, handles commands and
+# menus, and imports photo_editing (Pillow, the colour engine, the encoder and
+# the render pool) only when an update needs to render or upload an image.
 
 app = Flask(__name__)
 
@@ -12,196 +29,79 @@ app = Flask(__name__)
 # These must be set in your Vercel project settings
 TOKEN = os.environ.get('TELEGRAM_TOKEN')
 ADMIN_ID = os.environ.get('ADMIN_ID')
-JSONBIN_API_KEY = os.environ.get('JSONBIN_API_KEY')
-JSONBIN_BIN_ID = os.environ.get('JSONBIN_BIN_ID')
 BOT_USERNAME = os.environ.get('BOT_USERNAME')
 
 # --- Constants ---
-CREDITS_FOR_ADDING_MEMBERS = 2
-MEMBERS_TO_ADD = 10 # Changed back to 10 as per new instructions
 INVITE_CREDIT_AWARD = 1
-EDIT_COST = 1
-
-# --- Optimized Database Functions (JSONBin.io) ---
-def get_db():
-    """Fetches the entire database from JSONBin.io ONCE."""
-    if not JSONBIN_BIN_ID or not JSONBIN_API_KEY:
-        print("ስህተት: የJSONBin ኤፒአይ ቁልፍ ወይም የቢን መለያ ጠፍቷል።")
-        raise Exception("JSONBin API Key or Bin ID is missing.")
-    headers = {'X-Master-Key': JSONBIN_API_KEY, 'X-Bin-Meta': 'false'}
-    try:
-        req = requests.get(f'https://api.jsonbin.io/v3/b/{JSONBIN_BIN_ID}/latest', headers=headers)
-        req.raise_for_status()
-        return req.json()
-    except requests.exceptions.RequestException as e:
-        print(f"ዳታቤዙን በማምጣት ላይ ስህተት ተፈጥሯል: {e}")
-        return {'users': {}} # On failure, return a valid empty structure
-
-def update_db(data):
-    """Updates the entire database on JSONBin.io ONCE."""
-    if not JSONBIN_BIN_ID or not JSONBIN_API_KEY:
-        print("ስህተት: የJSONBin ኤፒአይ ቁልፍ ወይም የቢን መለያ ጠፍቷል።")
-        raise Exception("JSONBin API Key or Bin ID is missing.")
-    headers = {'Content-Type': 'application/json', 'X-Master-Key': JSONBIN_API_KEY}
-    try:
-        req = requests.put(f'https://api.jsonbin.io/v3/b/{JSONBIN_BIN_ID}', json=data, headers=headers)
-        req.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        print(f"ዳታቤዙን በማዘመን ላይ ስህተት ተፈጥሯል: {e}")
-
-# --- Telegram API Functions ---
-def send_telegram_message(chat_id, text, reply_markup=None):
-    """Sends a text message using the Telegram Bot API."""
-    url = f"https://api.telegram.org/bot{TOKEN}/sendMessage"
-    payload = {'chat_id': chat_id, 'text': text, 'parse_mode': 'Markdown'}
-    if reply_markup:
-        payload['reply_markup'] = json.dumps(reply_markup)
-    try:
-        requests.post(url, json=payload)
-    except Exception as e:
-        print(f"መልዕክት በመላክ ላይ ስህተት ተፈጥሯል: {e}")
-
-def answer_callback_query(callback_query_id, text=None):
-    """Answers a callback query to remove the loading state on the button."""
-    url = f"https://api.telegram.org/bot{TOKEN}/answerCallbackQuery"
-    payload = {'callback_query_id': callback_query_id}
-    if text:
-        payload['text'] = text
-    try:
-        requests.post(url, json=payload)
-    except Exception as e:
-        print(f"Callback query በመመለስ ላይ ስህተት: {e}")
-
-def edit_message_reply_markup(chat_id, message_id):
-    """Edits the reply markup of a message to remove the buttons."""
-    url = f"https://api.telegram.org/bot{TOKEN}/editMessageReplyMarkup"
-    payload = {'chat_id': chat_id, 'message_id': message_id, 'reply_markup': json.dumps({'inline_keyboard': []})}
-    try:
-        requests.post(url, json=payload)
-    except Exception as e:
-        print(f"Reply markup በማስተካከል ላይ ስህተት: {e}")
-
-def send_or_edit_photo(chat_id, image, caption, message_id=None, reply_markup=None):
-    """Sends or edits a photo message with an inline keyboard."""
-    output_buffer = io.BytesIO()
-    image.save(output_buffer, format='JPEG', quality=95)
-    output_buffer.seek(0)
-    
-    final_reply_markup = reply_markup if reply_markup is not None else {'inline_keyboard': []}
-    
-    try:
-        if message_id:
-            url = f"https://api.telegram.org/bot{TOKEN}/editMessageMedia"
-            media = {'type': 'photo', 'media': 'attach://edited_image.jpg', 'caption': caption, 'parse_mode': 'Markdown'}
-            files = {'edited_image.jpg': output_buffer}
-            data = {'chat_id': chat_id, 'message_id': message_id, 'media': json.dumps(media), 'reply_markup': json.dumps(final_reply_markup)}
-            response = requests.post(url, data=data, files=files)
-            response.raise_for_status()
-            return message_id
-        else:
-            url = f"https://api.telegram.org/bot{TOKEN}/sendPhoto"
-            files = {'photo': ('edited_image.jpg', output_buffer, 'image/jpeg')}
-            data = {'chat_id': chat_id, 'caption': caption, 'parse_mode': 'Markdown', 'reply_markup': json.dumps(final_reply_markup)}
-            response = requests.post(url, files=files, data=data)
-            response.raise_for_status()
-            if response.ok:
-                return response.json()['result']['message_id']
-    except requests.exceptions.RequestException as e:
-        print(f"ፎቶ በመላክ/በማስተካከል ላይ ስህተት ተፈጥሯል: {e} - Response: {e.response.text if e.response else 'N/A'}")
-    return None
-
-# --- Image Processing Functions ---
-def get_image_from_telegram(file_id):
-    """Downloads an image from Telegram servers using its file_id."""
-    try:
-        file_path_url = f"https://api.telegram.org/bot{TOKEN}/getFile?file_id={file_id}"
-        res = requests.get(file_path_url).json()
-        if not res.get('ok'):
-            print(f"የፋይል ዱካ በማግኘት ላይ ስህተት: {res.get('description')}")
-            return None
-        file_path = res['result']['file_path']
-        image_download_url = f"https://api.telegram.org/file/bot{TOKEN}/{file_path}"
-        image_res = requests.get(image_download_url)
-        image_res.raise_for_status()
-        return Image.open(io.BytesIO(image_res.content)).convert("RGB")
-    except Exception as e:
-        print(f"ፎቶ በማውረድ ላይ ስህተት: {e}")
-        return None
-
-def apply_adjustment(image, adjustment_type, value):
-    """Applies a single adjustment to an image."""
-    if adjustment_type == 'brightness':
-        return ImageEnhance.Brightness(image).enhance(1 + 0.1 * value)
-    elif adjustment_type == 'contrast':
-        return ImageEnhance.Contrast(image).enhance(1 + 0.1 * value)
-    elif adjustment_type == 'saturation':
-        return ImageEnhance.Color(image).enhance(1 + 0.2 * value)
-    elif adjustment_type == 'warmth':
-        r, g, b = image.split()
-        r = r.point(lambda i: i * (1 + 0.05 * value))
-        b = b.point(lambda i: i * (1 - 0.05 * value))
-        return Image.merge('RGB', (r, g, b))
-    elif adjustment_type == 'shadow':
-        return ImageEnhance.Brightness(image).enhance(1 + 0.1 * value)
-    return image
-
-def reapply_adjustments(original_image, adjustments):
-    """Re-applies a list of adjustments to the original image."""
-    img = original_image.copy()
-    for adj in adjustments:
-        img = apply_adjustment(img, adj['tool'], adj['value'])
-    return img
-
-def apply_filter(image, filter_type):
-    """Applies a one-time filter to an image."""
-    if filter_type == 'saturate': return ImageEnhance.Color(image).enhance(1.5)
-    elif filter_type == 'enhance':
-        enhanced_image = ImageEnhance.Contrast(image).enhance(1.4)
-        enhanced_image = ImageEnhance.Color(enhanced_image).enhance(1.2)
-        enhanced_image = ImageEnhance.Sharpness(enhanced_image).enhance(1.3)
-        return enhanced_image
-    elif filter_type == 'dynamic': return ImageEnhance.Contrast(image).enhance(1.5).filter(ImageFilter.SHARPEN)
-    elif filter_type == 'airy': return ImageEnhance.Color(ImageEnhance.Brightness(image).enhance(1.2)).enhance(0.8)
-    elif filter_type == 'cinematic':
-        desaturated = ImageEnhance.Color(image).enhance(0.6)
-        contrasted = ImageEnhance.Contrast(desaturated).enhance(1.4)
-        blue_layer = Image.new('RGB', contrasted.size, '#001122')
-        return Image.blend(contrasted, blue_layer, alpha=0.2)
-    elif filter_type == 'noir': return ImageEnhance.Contrast(ImageOps.grayscale(image)).enhance(1.8)
-    return image
-
-# --- UI Menus (Amharic) ---
-def get_start_menu():
-    """Generates the main menu for the /start command."""
-    return {"inline_keyboard": [
-        [{"text": "💰 ክሬዲቴን አሳይ", "callback_data": "mycredit"}, {"text": "🔗 መጋበዣ ሊንክ", "callback_data": "mylink"}],
-        [{"text": "🎁 ክሬዲት ማግኘት", "callback_data": "unlock"}, {"text": "🆘 እርዳታ", "callback_data": "support"}]
-    ]}
-
-def get_main_menu():
-    return {"inline_keyboard": [[{"text": "🎨 ማጣሪያዎች (Filters)", "callback_data": "menu_filters"}, {"text": "🛠️ ማስተካከያዎች (Adjust)", "callback_data": "menu_adjust"}]]}
-
-def get_filters_menu():
-    return {"inline_keyboard": [
-        [{"text": "🌈 Saturation", "callback_data": "filter_saturate"}, {"text": "✨ Enhance", "callback_data": "filter_enhance"}],
-        [{"text": "⚡ Dynamic", "callback_data": "filter_dynamic"}, {"text": "💨 Airy", "callback_data": "filter_airy"}],
-        [{"text": "🎬 Cinematic", "callback_data": "filter_cinematic"}, {"text": "⚫ Noir (B&W)", "callback_data": "filter_noir"}],
-        [{"text": "↩️ ወደ ዋና ማውጫ ተመለስ", "callback_data": "menu_main"}]
-    ]}
-
-def get_adjust_menu():
-    return {"inline_keyboard": [
-        [{"text": "☀️ Brightness", "callback_data": "adjust_brightness"}, {"text": "🌗 Contrast", "callback_data": "adjust_contrast"}],
-        [{"text": "🎨 Saturation", "callback_data": "adjust_saturation"}, {"text": "🌡️ Warmth", "callback_data": "adjust_warmth"}],
-        [{"text": "🌒 Shadow", "callback_data": "adjust_shadow"}, {"text": "🔄 ሁሉንም መልስ", "callback_data": "adjust_reset"}],
-        [{"text": "✅ ተግብር እና ላክ", "callback_data": "adjust_send"}, {"text": "↩️ ወደ ዋና ማውጫ ተመለስ", "callback_data": "menu_main"}]
-    ]}
-
-def get_adjust_submenu(tool):
-    return {"inline_keyboard": [
-        [{"text": "➕ ጨምር", "callback_data": f"do_{tool}_1"}, {"text": "➖ ቀንስ", "callback_data": f"do_{tool}_-1"}],
-        [{"text": "↩️ ወደ ማስተካከያ ማውጫ ተመለስ", "callback_data": "menu_adjust"}]
-    ]}
+ACTIVE_USER_DAYS = 7  # /status counts users seen within this many days
+ACTIVITY_RESOLUTION = 3600  # A user's last-activity time is rewritten at most this often
+
+# --- Update Processing ---
+# With ASYNC_UPDATES=1 the webhook only validates and enqueues updates and a
+# worker pool processes them. Use it on hosts that keep running after the
+# response is sent (e.g. gunicorn); serverless platforms may freeze the workers.
+ASYNC_UPDATES = os.environ.get('ASYNC_UPDATES') == '1'
+UPDATE_WORKERS = int(os.environ.get('UPDATE_WORKERS', 8))
+_update_queue = None
+_update_queue_lock = threading.Lock()
+# Recently handled update_ids, so a redelivery to this instance is dropped.
+# Credit changes are also keyed in the ledger, which covers other instances.
+_seen_updates = SeenWindow()
+
+metrics.add_collector('photo_bot_media_cache', media_cache.stats)
+
+def note_activity(user_id, user_data):
+    """Updates the user's last-activity time, which is only written once it is ACTIVITY_RESOLUTION old."""
+    now = time.time()
+    if now - user_data.get('last_active', 0) >= ACTIVITY_RESOLUTION:
+        get_storage().touch_user(user_id, now)
+
+# --- Session Rendering ---
+def show_preview_state(chat_id, message_id, user_id, session, caption, reply_markup, session_changed=False):
+    """Shows the session's current preview, uploading only states Telegram has never seen.
+
+    If the message already shows this state only the caption and keyboard are
+    edited; if the state was uploaded before its Telegram file_id is re-sent.
+    Otherwise the preview is rendered, encoded and uploaded.
+    """
+    state = state_id(session['file_id'], 'preview', sessions.session_steps(session))
+    shown = False
+    if session.get('shown') == state and edit_message_caption(chat_id, message_id, caption, reply_markup):
+        media_cache.record('caption_edits')
+        shown = True
+    if not shown:
+        cached_file_id = media_cache.get(state)
+        if cached_file_id:
+            shown = send_or_edit_photo(chat_id, cached_file_id, caption, message_id=message_id, reply_markup=reply_markup) is not None
+    if not shown:
+        import photo_editing
+        shown = photo_editing.upload_preview(chat_id, message_id, session, caption, reply_markup, state)
+    if shown and session.get('shown') != state:
+        session['shown'] = state
+        session_changed = True
+    if session_changed:
+        sessions.save_session(user_id, session)
+
+# --- Album Editing ---
+def collect_album_photo(chat_id, user_id, user_data, message):
+    """Stores one photo of an album; the first photo of the album also gets the menu.
+
+    A photo that arrives after the album was edited or expired is dropped.
+    """
+    storage = get_storage()
+    media_group_id = message['media_group_id']
+    album = {'user_id': user_id, 'chat_id': chat_id, 'expires_at': time.time() + sessions.ALBUM_TTL}
+    first = storage.create_record(sessions.ALBUM_KIND, media_group_id, album)
+    if not first:
+        album = storage.get_record(sessions.ALBUM_KIND, media_group_id)
+        if (not album or album.get('expires_at', 0) < time.time()
+                or storage.get_record(sessions.ALBUM_CLAIM_KIND, media_group_id)):
+            return
+    storage.put_record(sessions.album_photos_kind(media_group_id), message['message_id'],
+                       {'file_id': message['photo'][-1]['file_id'], 'expires_at': album['expires_at']})
+    if first:
+        send_telegram_message(chat_id, "📚 አልበምዎ ደርሷል! ለሁሉም ፎቶዎች የሚተገበር ማጣሪያ ወይም ቅንብር ይምረጡ።",
+                              reply_markup=get_album_menu(media_group_id, user_id, bool(user_data.get('last_recipe'))))
 
 # --- Route Handlers ---
 
@@ -212,10 +112,49 @@ def favicon():
 
 @app.route('/', methods=['POST'])
 def webhook():
-    """This is the main webhook that handles all Telegram updates."""
-    update = request.get_json()
-    db_data = None 
-    db_changed = False 
+    """This is the main webhook that receives all Telegram updates."""
+    update = request.get_json(silent=True)
+    if not isinstance(update, dict) or not isinstance(update.get('update_id'), int):
+        return 'ok' # Nothing Telegram would want redelivered
+    if ASYNC_UPDATES:
+        # Acknowledge at once; a worker processes the update (and drops redeliveries).
+        get_update_queue().submit(update)
+        return 'ok'
+    if not _seen_updates.add(update['update_id']):
+        return 'ok' # A redelivery of an update this instance already handled
+    try:
+        return process_update(update)
+    except Exception:
+        _seen_updates.discard(update['update_id'])  # Let Telegram's retry through
+        raise
+
+def get_update_queue():
+    """Returns the process-wide update queue, starting its workers on first use."""
+    global _update_queue
+    with _update_queue_lock:
+        if _update_queue is None:
+            _update_queue = LocalUpdateQueue(process_update, workers=UPDATE_WORKERS, seen=_seen_updates)
+            metrics.add_collector('photo_bot_update_queue', _update_queue.stats)
+        return _update_queue
+
+def process_update(update):
+    """Handles one Telegram update, logging its trace and the memory its image ingest used."""
+    update_type = next((key for key in update if key != 'update_id'), 'unknown')
+    text = (update.get('message') or {}).get('text') or ''
+    label = (update.get('callback_query') or {}).get('data') or (text.split()[0] if text.startswith('/') else None)
+    begin_trace(update_type, label)
+    ingest.begin_request()
+    try:
+        return handle_update(update)
+    finally:
+        ingest.end_request()
+        end_trace()
+
+def handle_update(update):
+    storage = get_storage()
+    storage.refresh()
+    broadcast.resume_interrupted_jobs()
+    sessions.maybe_sweep()
 
     # --- Callback Query Handler (Button Presses) ---
     if 'callback_query' in update:
@@ -225,13 +164,14 @@ def webhook():
         message_id = callback_query['message']['message_id']
         user_id = str(callback_query['from']['id'])
         
-        db_data = get_db()
-        user_data = db_data.get('users', {}).get(user_id)
+        with span('storage.get_user'):
+            user_data = storage.get_user(user_id)
 
         if not user_data:
             answer_callback_query(callback_query['id'])
             send_telegram_message(chat_id, "ይቅርታ, የእርስዎን መረጃ ማግኘት አልቻልኩም። እባክዎ /start ብለው እንደገና ይጀምሩ።")
             return 'ok'
+        note_activity(user_id, user_data)
             
         # --- Main Menu Button Handlers ---
         if data == 'mycredit':
@@ -244,7 +184,8 @@ def webhook():
             answer_callback_query(callback_query['id'])
             edit_message_reply_markup(chat_id, message_id)
             invite_link = f"https://t.me/{BOT_USERNAME}?start={user_id}"
-            send_telegram_message(chat_id, f"🔗 የእርስዎ የግል መጋበዣ ሊንክ ይኸውና:\n\n`{invite_link}`\n\nለጓደኞችዎ ያጋሩ።")
+            invited_count = len(storage.find_users('invited_by', user_id))
+            send_telegram_message(chat_id, f"🔗 የእርስዎ የግል መጋበዣ ሊንክ ይኸውና:\n\n`{invite_link}`\n\nለጓደኞችዎ ያጋሩ። እስካሁን *{invited_count}* ሰዎች በሊንክዎ ገብተዋል።")
             return 'ok'
 
         elif data == 'unlock':
@@ -264,65 +205,62 @@ def webhook():
             send_telegram_message(chat_id, "🆘 ለእርዳታ ወይም አስተያየት ለመስጠት፣ መልዕክትዎን በዚህ መልኩ ይላኩ:\n`/support የእርስዎ መልዕክት`")
             return 'ok'
 
+        # --- Album Handlers ---
+        if data.startswith('album_'):
+            _, media_group_id, choice = data.split('_', 2)
+            if choice == 'last':
+                recipe = user_data.get('last_recipe')
+            elif choice.startswith('p_'):
+                recipe = recipes.get_recipe(user_id, choice[len('p_'):])
+            else:
+                recipe = recipes.make_recipe(filter_type=choice)
+            if not recipe:
+                answer_callback_query(callback_query['id'], text="ይህ ቅንብር አልተገኘም።")
+                return 'ok'
+            answer_callback_query(callback_query['id'])
+            import photo_editing
+            photo_editing.edit_album(chat_id, user_id, message_id, media_group_id, recipe, f"album:{callback_query['id']}")
+            return 'ok'
+
         # --- Photo Editing Session Handlers ---
-        session = user_data.get('session', {})
+        session = sessions.get_session(user_id) or sessions.migrate_legacy_session(user_id, user_data)
 
-        if not session.get('file_id'):
+        if not session:
             answer_callback_query(callback_query['id'], text="የፎቶ ማስተካከያ ጊዜው አልፎበታል።")
             return 'ok'
 
-        original_image = get_image_from_telegram(session['file_id'])
-        if not original_image:
+        # Navigation and interactive steps only need the preview, and often not even that.
+        view = get_session_view(data, user_id)
+        if view:
             answer_callback_query(callback_query['id'])
-            send_telegram_message(chat_id, "ይቅርታ, ዋናውን ፎቶ ማግኘት አልቻልኩም። እባክዎ እንደገና ይሞክሩ።")
+            show_preview_state(chat_id, message_id, user_id, session, *view)
             return 'ok'
-        
-        answer_callback_query(callback_query['id']) 
-        current_image = reapply_adjustments(original_image, session.get('adjustments', []))
-
-        if data == 'menu_main':
-            send_or_edit_photo(chat_id, current_image, "የማስተካከያ አይነት ይምረጡ:", message_id=message_id, reply_markup=get_main_menu())
-        elif data == 'menu_filters':
-            send_or_edit_photo(chat_id, current_image, "አንድ ማጣሪያ ይምረጡ:", message_id=message_id, reply_markup=get_filters_menu())
-        elif data == 'menu_adjust':
-            send_or_edit_photo(chat_id, current_image, "የማስተካከያ መሳሪያ ይምረጡ:", message_id=message_id, reply_markup=get_adjust_menu())
-
-        elif data.startswith('filter_'):
-            filter_type = data.split('_')[1]
-            edited_image = apply_filter(original_image.copy(), filter_type)
-            send_or_edit_photo(chat_id, edited_image, f"✅ *{filter_type.capitalize()}* ማጣሪያ ተተግብሯል! የመጨረሻው ፎቶዎ ዝግጁ ነው።", message_id=message_id, reply_markup=None)
-            user_data['session'] = {}
-            db_changed = True
-
-        elif data.startswith('adjust_'):
-            tool = data.split('_')[1]
-            if tool == 'send':
-                send_or_edit_photo(chat_id, current_image, "✅ የእርስዎ የመጨረሻ ፎቶ ዝግጁ ነው!", message_id=message_id, reply_markup=None)
-                user_data['session'] = {}
-                db_changed = True
-            elif tool == 'reset':
-                session['adjustments'] = []
-                user_data['session'] = session
-                db_changed = True
-                send_or_edit_photo(chat_id, original_image, "🔄 ፎቶው ወደ መጀመሪያው ተመልሷል።", message_id=message_id, reply_markup=get_adjust_menu())
+
+        if data.startswith('do_') or data.startswith('undo_') or data == 'adjust_reset':
+            answer_callback_query(callback_query['id'])
+            if data.startswith('do_'):
+                parts = data.split('_')
+                tool, value = parts[1], int(parts[2])
+                sessions.push_step(session, tool, value)
+                caption, reply_markup = "ቅድመ-እይታ ታድሷል።", get_adjust_submenu(tool)
+            elif data.startswith('undo_'):
+                sessions.undo_step(session)
+                caption, reply_markup = "⏪ የመጨረሻው ማስተካከያ ተቀልብሷል።", get_adjust_submenu(data.split('_')[1])
             else:
-                send_or_edit_photo(chat_id, current_image, f"*{tool.capitalize()}* በማስተካከል ላይ...", message_id=message_id, reply_markup=get_adjust_submenu(tool))
+                sessions.reset_steps(session)
+                caption, reply_markup = "🔄 ፎቶው ወደ መጀመሪያው ተመልሷል።", ADJUST_MENU
+            show_preview_state(chat_id, message_id, user_id, session, caption, reply_markup, session_changed=True)
+            return 'ok'
 
-        elif data.startswith('do_'):
-            parts = data.split('_')
-            tool, value = parts[1], int(parts[2])
-            
-            session.setdefault('adjustments', []).append({'tool': tool, 'value': value})
-            user_data['session'] = session
-            db_changed = True
-            
-            newly_adjusted_image = apply_adjustment(current_image, tool, value)
-            send_or_edit_photo(chat_id, newly_adjusted_image, "ቅድመ-እይታ ታድሷል።", message_id=message_id, reply_markup=get_adjust_submenu(tool))
-        
-        if db_changed:
-            db_data['users'][user_id] = user_data
-            update_db(db_data)
-        
+        recipe = None
+        if data.startswith('preset_'):
+            recipe = recipes.get_recipe(user_id, data[len('preset_'):])
+            if not recipe:
+                answer_callback_query(callback_query['id'], text="ይህ ቅንብር አልተገኘም።")
+                return 'ok'
+
+        import photo_editing
+        photo_editing.finish_session(callback_query, chat_id, message_id, user_id, session, recipe)
         return 'ok'
 
     # --- Handler for Bot Status Changes (e.g., being added to a group) ---
@@ -335,16 +273,10 @@ def webhook():
             adder_id = str(my_chat_member['from']['id'])
             group_id = my_chat_member['chat']['id']
             
-            db_data = get_db()
-            users_data = db_data.get('users', {})
-            adder_data = users_data.get(adder_id)
-
-            # Create a task for the user who added the bot
-            if adder_data:
-                adder_data['add_task'] = {'group_id': group_id, 'added_count': 0, 'completed': False}
-                users_data[adder_id] = adder_data
-                update_db(db_data)
-                # This process is now silent, no confirmation message to the group.
+            # Create a task for the user who added the bot (a no-op for unknown users).
+            # This process is now silent, no confirmation message to the group.
+            task = {'id': uuid.uuid4().hex[:8], 'group_id': group_id, 'added_count': 0, 'completed': False}
+            storage.update_user(adder_id, {'add_task': task})
         
         return 'ok'
 
@@ -356,51 +288,41 @@ def webhook():
         user_name = message['from'].get('first_name', 'User')
         text = message.get('text', '')
 
-        db_data = get_db()
-        users_data = db_data.get('users', {})
-        
         if 'new_chat_members' in message:
             adder_id = str(message['from']['id'])
             adder_name = message['from'].get('first_name', 'User')
-            adder_data = users_data.get(adder_id)
-
-            if adder_data:
-                task = adder_data.get('add_task', {})
-                if task.get('group_id') == chat_id and not task.get('completed'):
-                    new_member_count = len([m for m in message['new_chat_members'] if not m.get('is_bot')])
-                    if new_member_count > 0:
-                        task['added_count'] = task.get('added_count', 0) + new_member_count
+            # Most joins are in groups without an open task; the index answers those without touching the adder.
+            if adder_id in storage.find_users('task_group', chat_id):
+                new_member_count = len([m for m in message['new_chat_members'] if not m.get('is_bot')])
+                if new_member_count > 0:
+                    # One atomic step, so concurrent joins cannot both complete the task.
+                    task, completed = storage.add_task_members(adder_id, chat_id, new_member_count, MEMBERS_TO_ADD)
+                    if completed:
+                        # Tasks created before they had ids are keyed by their group.
+                        task_id = task.get('id', task['group_id'])
+                        storage.add_credits(adder_id, CREDITS_FOR_ADDING_MEMBERS, key=f"add-task:{adder_id}:{task_id}")
                         
-                        if task['added_count'] >= MEMBERS_TO_ADD:
-                            task['completed'] = True
-                            adder_data['credits'] = adder_data.get('credits', 0) + CREDITS_FOR_ADDING_MEMBERS
-                            
-                            completion_message = (
-                                f"🎉 እንኳን ደስ አለዎት {adder_name}! *{MEMBERS_TO_ADD}* ሰዎችን ስለጨመሩ *{CREDITS_FOR_ADDING_MEMBERS}* ክሬዲቶችን አግኝተዋል።\n\n"
-                                f"አሁን ፎቶዎችን ማስተካከል ይችላሉ። እዚህ ጋር ይንኩ 👉 @{BOT_USERNAME}"
-                            )
-                            send_telegram_message(chat_id, completion_message)
-                            
-                        adder_data['add_task'] = task
-                        users_data[adder_id] = adder_data
-                        update_db(db_data)
+                        completion_message = (
+                            f"🎉 እንኳን ደስ አለዎት {adder_name}! *{MEMBERS_TO_ADD}* ሰዎችን ስለጨመሩ *{CREDITS_FOR_ADDING_MEMBERS}* ክሬዲቶችን አግኝተዋል።\n\n"
+                            f"አሁን ፎቶዎችን ማስተካከል ይችላሉ። እዚህ ጋር ይንኩ 👉 @{BOT_USERNAME}"
+                        )
+                        send_telegram_message(chat_id, completion_message)
             return 'ok'
 
-        user_data = users_data.get(user_id)
+        with span('storage.get_user'):
+            user_data = storage.get_user(user_id)
         is_new_user = not user_data
+        if user_data:
+            note_activity(user_id, user_data)
 
         if is_new_user:
             invited_by = text.split()[1] if text.startswith('/start ') and len(text.split()) > 1 else None
-            user_data = {'credits': 1, 'invited_by': invited_by, 'add_task': {}, 'session': {}}
-            users_data[user_id] = user_data
-            db_changed = True
-            
-            if invited_by:
+            user_data = {'credits': 1, 'invited_by': invited_by, 'add_task': {}}
+            # create_user() is a no-op if a concurrent update already created this user.
+            if storage.create_user(user_id, user_data) and invited_by:
                 try:
-                    inviter_data = users_data.get(str(invited_by))
-                    if inviter_data:
-                        inviter_data['credits'] = inviter_data.get('credits', 0) + INVITE_CREDIT_AWARD
-                        users_data[str(invited_by)] = inviter_data
+                    # Keyed by the new user, so each person earns their inviter one award at most.
+                    if storage.add_credits(str(invited_by), INVITE_CREDIT_AWARD, key=f"invite:{user_id}")[1]:
                         send_telegram_message(invited_by, f"🎉 አንድ ሰው በእርስዎ ሊንክ ተጠቅሞ ስለገባ *{INVITE_CREDIT_AWARD}* ክሬዲት አግኝተዋል።")
                 except Exception as e:
                     print(f"የግብዣ ክሬዲት በመስጠት ላይ ስህተት: {e}")
@@ -410,42 +332,13 @@ def webhook():
                 send_telegram_message(chat_id, "እባክዎ መጀመሪያ ቦቱን በ /start ትዕዛዝ ያስጀምሩት።")
                 return 'ok'
             
-            # Simplified workflow: Check credit immediately upon receiving a photo
-            if user_data.get('credits', 0) < EDIT_COST:
-                no_credit_message = (
-                    "🚫 *ይቅርታ! በቂ ነጥብ የሎትም!*\n"
-                    "📸 ምስል ለመስራት፣ ከዚህ አንዱን ይከተሉ፦\n\n"
-                    f"👤 @havivss group ውስጥ *{MEMBERS_TO_ADD}* ሰው add ያድርጉ ✅\n"
-                    "ወይም\n"
-                    "🔗 በ invite link *1* ሰው ላኩ 🎯\n\n"
-                    "🚀 ከዚያ photo ይላኩ። 🤖✨"
-                )
-                send_telegram_message(chat_id, no_credit_message)
+            # Album photos are collected; credits are taken per album when a filter is chosen.
+            if message.get('media_group_id'):
+                collect_album_photo(chat_id, user_id, user_data, message)
                 return 'ok'
 
-            # If user has credit, proceed
-            user_data['credits'] -= EDIT_COST
-            db_changed = True
-            file_id = message['photo'][-1]['file_id']
-            
-            send_telegram_message(chat_id, "⏳ ፎቶዎን በማዘጋጀት ላይ ነው...")
-
-            image = get_image_from_telegram(file_id)
-            if image:
-                caption = "የማስተካከያ አይነት ይምረጡ።"
-                message_id = send_or_edit_photo(chat_id, image, caption, reply_markup=get_main_menu())
-
-                if message_id:
-                    user_data['session'] = {'file_id': file_id, 'message_id': message_id, 'adjustments': []}
-                else:
-                    user_data['credits'] += EDIT_COST # Refund credit
-                    send_telegram_message(chat_id, "❌ ስህተት ተፈጥሯል። ክሬዲትዎ አልተቀነሰም።")
-            else:
-                user_data['credits'] += EDIT_COST # Refund credit
-                send_telegram_message(chat_id, "❌ ይቅርታ, ፎቶዎን ማውረድ አልተቻለም። ክሬዲትዎ አልተቀነሰም።")
-            
-            users_data[user_id] = user_data
-            update_db(db_data)
+            import photo_editing
+            photo_editing.start_session(update, chat_id, user_id, message)
             return 'ok'
 
         if text.startswith('/'):
@@ -464,7 +357,7 @@ def webhook():
                     "ወደ ፎቶ ማስተካከያ ቦት እንኳን በደህና መጡ።\n\n"
                     "ፎቶ በመላክ ይጀምሩ ወይም ከታች ያሉትን አማራጮች ይጠቀሙ።"
                 )
-                send_telegram_message(chat_id, start_message, reply_markup=get_start_menu())
+                send_telegram_message(chat_id, start_message, reply_markup=START_MENU)
             
             elif command == '/support':
                 if not args:
@@ -475,45 +368,80 @@ def webhook():
                     if ADMIN_ID: send_telegram_message(ADMIN_ID, forward_message)
                     send_telegram_message(chat_id, "✅ መልዕክትዎ ለአስተዳዳሪው ተልኳል።")
 
+            elif command == '/savepreset':
+                # Saves the open session's adjustments, or else the last finished edit.
+                name = args[0] if len(args) == 1 else ''
+                error = recipes.check_name(name) if name else "ምሳሌ: `/savepreset myfavorite`"
+                session = sessions.get_session(user_id)
+                session_steps = sessions.session_steps(session) if session else ()
+                recipe = recipes.make_recipe(session_steps) if session_steps else user_data.get('last_recipe')
+                if error:
+                    send_telegram_message(chat_id, error)
+                elif not recipe:
+                    send_telegram_message(chat_id, "የሚቀመጥ ማስተካከያ የለም። መጀመሪያ ፎቶ ያስተካክሉ።")
+                elif not recipes.save_recipe(user_id, name, recipe):
+                    send_telegram_message(chat_id, f"ቢበዛ *{recipes.MAX_PRESETS}* ቅንብሮች ማስቀመጥ ይችላሉ። በ `/delpreset` አንዱን ይሰርዙ።")
+                else:
+                    send_telegram_message(chat_id, f"✅ *{name}* ቅንብር ተቀምጧል። በሚቀጥለው ፎቶ '⭐ ቅንብሮች' ውስጥ ያገኙታል።")
+
+            elif command == '/delpreset':
+                if args and recipes.delete_recipe(user_id, args[0]):
+                    send_telegram_message(chat_id, f"🗑️ *{args[0]}* ቅንብር ተሰርዟል።")
+                else:
+                    send_telegram_message(chat_id, "ይህ ቅንብር አልተገኘም። ምሳሌ: `/delpreset myfavorite`")
+
             # Admin commands...
             elif is_admin and command == '/status':
-                user_count = len(users_data)
-                send_telegram_message(chat_id, f"📊 *የቦት ሁኔታ*\n\nጠቅላላ ተጠቃሚዎች: *{user_count}*")
+                stats = storage.user_stats(time.time() - ACTIVE_USER_DAYS * 86400)
+                send_telegram_message(chat_id, (
+                    f"📊 *የቦት ሁኔታ*\n\n"
+                    f"ጠቅላላ ተጠቃሚዎች: *{stats['users']}*\n"
+                    f"ንቁ ተጠቃሚዎች (ባለፉት {ACTIVE_USER_DAYS} ቀናት): *{stats['active_users']}*\n"
+                    f"በተጠቃሚዎች እጅ ያሉ ክሬዲቶች: *{stats['credits']}*"
+                ))
 
             elif is_admin and command == '/broadcast':
                 if not args:
                     send_telegram_message(chat_id, "አጠቃቀም: `/broadcast <message>`")
                 else:
-                    broadcast_text = " ".join(args)
-                    sent_count = 0
-                    for uid in users_data.keys():
-                        try:
-                            send_telegram_message(uid, broadcast_text)
-                            sent_count += 1
-                            time.sleep(0.1) 
-                        except Exception: pass
-                    send_telegram_message(chat_id, f"✅ መልዕክቱ ለ *{sent_count}* ከ *{len(users_data)}* ተጠቃሚዎች ተልኳል።")
+                    # Delivery runs in the background; the runner reports back when it is done.
+                    job_id = broadcast.create_job(" ".join(args), chat_id)
+                    broadcast.start_job(job_id)
+                    send_telegram_message(chat_id, f"📣 የብሮድካስት ስራ `{job_id}` ተጀምሯል። ሁኔታውን ለማየት `/broadcast_status` ይጠቀሙ።")
+
+            elif is_admin and command == '/broadcast_status':
+                job_id = args[0] if args else broadcast.latest_job_id()
+                job, counts = broadcast.job_progress(job_id) if job_id else (None, None)
+                if not job:
+                    send_telegram_message(chat_id, "❌ የብሮድካስት ስራ አልተገኘም።")
+                else:
+                    send_telegram_message(chat_id, (
+                        f"📊 *የብሮድካስት ሁኔታ* (`{job_id}`)\n\n"
+                        f"ተልኳል: *{counts['sent']}*\n"
+                        f"ቦቱን ያገዱ: *{counts['blocked']}*\n"
+                        f"አልተሳካም: *{counts['failed']}*\n"
+                        f"በመጠባበቅ ላይ: *{counts['pending']}*\n"
+                        f"ጠቅላላ: *{job['total']}*"
+                    ))
 
             elif is_admin and command == '/addcredit':
                 if len(args) == 2 and args[1].isdigit():
                     target_user_id, amount = args[0], int(args[1])
-                    target_data = users_data.get(target_user_id)
-                    if target_data:
-                        target_data['credits'] = target_data.get('credits', 0) + amount
-                        users_data[target_user_id] = target_data
-                        db_changed = True
+                    balance, applied = storage.add_credits(target_user_id, amount, key=f"addcredit:{update['update_id']}")
+                    if applied:
                         send_telegram_message(chat_id, f"✅ *{amount}* ክሬዲት ለተጠቃሚ `{target_user_id}` በተሳካ ሁኔታ ተጨምሯል።")
                         send_telegram_message(target_user_id, f"🎉 አስተዳዳሪው *{amount}* ክሬዲት ወደ አካውንትዎ ጨምሯል!")
-                    else: send_telegram_message(chat_id, "❌ ተጠቃሚው አልተገኘም።")
+                    elif balance is None: send_telegram_message(chat_id, "❌ ተጠቃሚው አልተገኘም።")
                 else: send_telegram_message(chat_id, "አጠቃቀም: `/addcredit <user_id> <amount>`")
 
 
-        if db_changed:
-            db_data['users'] = users_data
-            update_db(db_data)
-
     return 'ok' 
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Exposes counters, latency histograms and cache statistics in Prometheus text format."""
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
 # This is the root route that can be used for health checks.
 @app.route('/')
 def index():
@@ -0,0 +1,105 @@
+import io
+import os
+import json
+import resource
+import threading
+
+import http_client
+from tracing import span, record_bytes
+
+# --- Environment Variables ---
+MAX_DOWNLOAD_BYTES = int(os.environ.get('MAX_DOWNLOAD_BYTES', 20 * 1024 * 1024))  # Telegram's own getFile limit
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 40_000_000))
+MAX_IMAGE_SIDE = int(os.environ.get('MAX_IMAGE_SIDE', 12000))
+
+# --- Constants ---
+CHUNK_SIZE = 64 * 1024
+ALLOWED_FORMATS = ('JPEG', 'PNG', 'WEBP')
+
+class IngestError(Exception):
+    """The download or image was rejected before it could use much memory."""
+
+# --- Per-request memory accounting ---
+# Pillow allocates pixel buffers outside Python's allocator, so tracemalloc
+# cannot see them, and RSS belongs to the whole process. The report therefore
+# gives the ingest working set it can count exactly (largest_ingest_bytes) and
+# how far this request raised the process's peak RSS (peak_rss_growth_kb,
+# which concurrent requests can share).
+_local = threading.local()
+
+def _peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def begin_request():
+    _local.report = {'downloaded_bytes': 0, 'decoded_bytes': 0, 'largest_ingest_bytes': 0, 'images': 0}
+    _local.start_peak_rss_kb = _peak_rss_kb()
+
+def _track(raw_bytes, decoded_bytes):
+    report = getattr(_local, 'report', None)
+    if report is None:
+        return
+    report['images'] += 1
+    report['downloaded_bytes'] += raw_bytes
+    report['decoded_bytes'] += decoded_bytes
+    # Encoded bytes and the decoded image are alive together while decoding.
+    report['largest_ingest_bytes'] = max(report['largest_ingest_bytes'], raw_bytes + decoded_bytes)
+
+def end_request():
+    """Logs one JSON line with this request's ingest memory figures, if it ingested anything."""
+    report = getattr(_local, 'report', None)
+    _local.report = None
+    if report and report['images']:
+        report['process_peak_rss_kb'] = _peak_rss_kb()
+        report['peak_rss_growth_kb'] = report['process_peak_rss_kb'] - _local.start_peak_rss_kb
+        print(json.dumps(dict(event='ingest_memory', **report)))
+    return report
+
+# --- Download ---
+def download(url, max_bytes=MAX_DOWNLOAD_BYTES):
+    """Streams url into memory, giving up as soon as it is larger than max_bytes."""
+    response = http_client.request('GET', url, endpoint='download', stream=True)
+    try:
+        response.raise_for_status()
+        declared = response.headers.get('Content-Length')
+        if declared and declared.isdigit() and int(declared) > max_bytes:
+            raise IngestError(f"download is {declared} bytes, limit is {max_bytes}")
+        buffer = bytearray()
+        for chunk in response.iter_content(CHUNK_SIZE):
+            buffer.extend(chunk)
+            if len(buffer) > max_bytes:
+                raise IngestError(f"download exceeded {max_bytes} bytes")
+        record_bytes('in', 'download', len(buffer))
+        return bytes(buffer)
+    finally:
+        response.close()
+
+# --- Decode ---
+def decode(raw, max_edge=None):
+    """Decodes an RGB image after checking its header.
+
+    The format and dimensions are validated before any pixels are decoded,
+    which rejects decompression bombs. When max_edge is given, JPEGs are
+    decoded at a reduced DCT scale (1/2, 1/4 or 1/8) that still covers
+    max_edge, so the full-size bitmap is never allocated.
+    """
+    # Pillow is imported here rather than at module level so the per-request
+    # accounting above stays cheap for updates without images. Anything PIL
+    # decodes outside decode() gets the same ceiling.
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    try:
+        image = Image.open(io.BytesIO(raw))
+    except Image.DecompressionBombError as e:
+        raise IngestError(str(e))
+    if image.format not in ALLOWED_FORMATS:
+        raise IngestError(f"unsupported format {image.format}")
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS or max(width, height) > MAX_IMAGE_SIDE:
+        raise IngestError(f"image is {width}x{height}, too large")
+    with span('decode', width=width, height=height):
+        if max_edge and image.format == 'JPEG' and max(width, height) > max_edge:
+            scale = max_edge / max(width, height)
+            image.draft('RGB', (max(1, int(width * scale)), max(1, int(height * scale))))
+        image = image.convert('RGB')
+    _track(len(raw), image.width * image.height * 3)
+    return image
@@ -0,0 +1,50 @@
+import threading
+from collections import OrderedDict
+
+MEDIA_CACHE_SIZE = 8192
+
+def state_id(file_id, variant, steps):
+    """Stable identifier for one rendered state, e.g. 'AgAD...|preview|brightness+2,warmth-1'."""
+    return f"{file_id}|{variant}|" + ",".join(f"{tool}{value:+d}" for tool, value in steps)
+
+class MediaCache:
+    """Remembers the Telegram file_id of every rendered state we have uploaded.
+
+    Telegram keeps uploaded photos, so showing a state again only needs its
+    file_id; when the message already shows the state, only the caption and
+    keyboard have to change. The counters record how many uploads that saved.
+    """
+
+    def __init__(self, max_entries=MEDIA_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._file_ids = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'uploads': 0, 'caption_edits': 0, 'file_id_reuses': 0}
+
+    def get(self, state):
+        with self._lock:
+            file_id = self._file_ids.get(state)
+            if file_id is not None:
+                self._file_ids.move_to_end(state)
+            return file_id
+
+    def put(self, state, file_id):
+        with self._lock:
+            self._file_ids[state] = file_id
+            self._file_ids.move_to_end(state)
+            if len(self._file_ids) > self.max_entries:
+                self._file_ids.popitem(last=False)
+
+    def record(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self._file_ids)
+        stats['uploads_avoided'] = stats['caption_edits'] + stats['file_id_reuses']
+        return stats
+
+# Shared by all requests handled by this process.
+media_cache = MediaCache()
@@ -0,0 +1,89 @@
+import recipes
+
+# --- Constants ---
+CREDITS_FOR_ADDING_MEMBERS = 2
+MEMBERS_TO_ADD = 10 # Changed back to 10 as per new instructions
+ADJUST_TOOLS = ('brightness', 'contrast', 'saturation', 'warmth', 'shadow')
+
+# --- UI Menus (Amharic) ---
+# The fixed menus are built once per process and shared by every update;
+# treat them as read-only.
+START_MENU = {"inline_keyboard": [
+    [{"text": "💰 ክሬዲቴን አሳይ", "callback_data": "mycredit"}, {"text": "🔗 መጋበዣ ሊንክ", "callback_data": "mylink"}],
+    [{"text": "🎁 ክሬዲት ማግኘት", "callback_data": "unlock"}, {"text": "🆘 እርዳታ", "callback_data": "support"}]
+]}
+
+MAIN_MENU = {"inline_keyboard": [
+    [{"text": "🎨 ማጣሪያዎች (Filters)", "callback_data": "menu_filters"}, {"text": "🛠️ ማስተካከያዎች (Adjust)", "callback_data": "menu_adjust"}],
+    [{"text": "⭐ ቅንብሮች (Presets)", "callback_data": "menu_presets"}]
+]}
+
+FILTERS_MENU = {"inline_keyboard": [
+    [{"text": "🌈 Saturation", "callback_data": "filter_saturate"}, {"text": "✨ Enhance", "callback_data": "filter_enhance"}],
+    [{"text": "⚡ Dynamic", "callback_data": "filter_dynamic"}, {"text": "💨 Airy", "callback_data": "filter_airy"}],
+    [{"text": "🎬 Cinematic", "callback_data": "filter_cinematic"}, {"text": "⚫ Noir (B&W)", "callback_data": "filter_noir"}],
+    [{"text": "↩️ ወደ ዋና ማውጫ ተመለስ", "callback_data": "menu_main"}]
+]}
+
+ADJUST_MENU = {"inline_keyboard": [
+    [{"text": "☀️ Brightness", "callback_data": "adjust_brightness"}, {"text": "🌗 Contrast", "callback_data": "adjust_contrast"}],
+    [{"text": "🎨 Saturation", "callback_data": "adjust_saturation"}, {"text": "🌡️ Warmth", "callback_data": "adjust_warmth"}],
+    [{"text": "🌒 Shadow", "callback_data": "adjust_shadow"}, {"text": "🔄 ሁሉንም መልስ", "callback_data": "adjust_reset"}],
+    [{"text": "✅ ተግብር እና ላክ", "callback_data": "adjust_send"}, {"text": "↩️ ወደ ዋና ማውጫ ተመለስ", "callback_data": "menu_main"}]
+]}
+
+# (label, filter_type) of every filter button, as the album menu offers them.
+FILTER_CHOICES = [(button["text"], button["callback_data"][len('filter_'):])
+                  for row in FILTERS_MENU["inline_keyboard"][:-1] for button in row]
+
+NO_CREDIT_MESSAGE = (
+    "🚫 *ይቅርታ! በቂ ነጥብ የሎትም!*\n"
+    "📸 ምስል ለመስራት፣ ከዚህ አንዱን ይከተሉ፦\n\n"
+    f"👤 @havivss group ውስጥ *{MEMBERS_TO_ADD}* ሰው add ያድርጉ ✅\n"
+    "ወይም\n"
+    "🔗 በ invite link *1* ሰው ላኩ 🎯\n\n"
+    "🚀 ከዚያ photo ይላኩ። 🤖✨"
+)
+
+def _adjust_submenu(tool):
+    return {"inline_keyboard": [
+        [{"text": "➕ ጨምር", "callback_data": f"do_{tool}_1"}, {"text": "➖ ቀንስ", "callback_data": f"do_{tool}_-1"}],
+        [{"text": "⏪ ቀልብስ (Undo)", "callback_data": f"undo_{tool}"}],
+        [{"text": "↩️ ወደ ማስተካከያ ማውጫ ተመለስ", "callback_data": "menu_adjust"}]
+    ]}
+
+ADJUST_SUBMENUS = {tool: _adjust_submenu(tool) for tool in ADJUST_TOOLS}
+
+def get_adjust_submenu(tool):
+    return ADJUST_SUBMENUS.get(tool) or _adjust_submenu(tool)
+
+def _button_rows(buttons, per_row=2):
+    return [buttons[i:i + per_row] for i in range(0, len(buttons), per_row)]
+
+def get_presets_menu(user_id):
+    """Built-in recipes and the user's saved presets; each applies in one tap."""
+    buttons = [{"text": label, "callback_data": f"preset_{name}"} for name, label in recipes.list_recipes(user_id)]
+    return {"inline_keyboard": _button_rows(buttons) + [[{"text": "↩️ ወደ ዋና ማውጫ ተመለስ", "callback_data": "menu_main"}]]}
+
+def get_album_menu(media_group_id, user_id, has_last_recipe=False):
+    """The filters and presets menus, with every choice applying to the whole album."""
+    keyboard = _button_rows([{"text": label, "callback_data": f"album_{media_group_id}_{filter_type}"} for label, filter_type in FILTER_CHOICES])
+    keyboard += _button_rows([{"text": label, "callback_data": f"album_{media_group_id}_p_{name}"} for name, label in recipes.list_recipes(user_id)])
+    if has_last_recipe:
+        keyboard.append([{"text": "🔁 የመጨረሻ ማስተካከያዬን ተጠቀም", "callback_data": f"album_{media_group_id}_last"}])
+    return {"inline_keyboard": keyboard}
+
+def get_session_view(data, user_id):
+    """Returns (caption, reply_markup) for navigation callbacks that do not change the image."""
+    if data == 'menu_main':
+        return "የማስተካከያ አይነት ይምረጡ:", MAIN_MENU
+    elif data == 'menu_filters':
+        return "አንድ ማጣሪያ ይምረጡ:", FILTERS_MENU
+    elif data == 'menu_presets':
+        return "አንድ ቅንብር ይምረጡ:", get_presets_menu(user_id)
+    elif data == 'menu_adjust':
+        return "የማስተካከያ መሳሪያ ይምረጡ:", ADJUST_MENU
+    elif data.startswith('adjust_') and data not in ('adjust_send', 'adjust_reset'):
+        tool = data.split('_')[1]
+        return f"*{tool.capitalize()}* በማስተካከል ላይ...", get_adjust_submenu(tool)
+    return None
@@ -0,0 +1,309 @@
+import io
+import os
+import time
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from PIL import Image
+
+import http_client
+import ingest
+import recipes
+import sessions
+from tracing import span, metrics
+from storage import get_storage
+from image_cache import original_cache
+from adjustments import AdjustmentEngine, collapse_adjustments
+from color_engine import compile_program
+from tiled_render import tiled_renderer
+from media_cache import state_id
+from encoder import encoder
+from menus import MAIN_MENU, NO_CREDIT_MESSAGE, get_album_menu
+from telegram_api import send_telegram_message, answer_callback_query, edit_message_reply_markup, send_or_edit_photo, send_media_group
+
+# The image-processing half of the bot. index.py imports this module only for
+# updates that render or upload a photo, so text-only updates never load Pillow.
+
+# --- Constants ---
+EDIT_COST = 1
+
+# --- Rendering ---
+# Interactive steps (menus, +/- previews) work on a downscaled proxy; only the
+# final send renders and encodes the full-resolution original.
+# Encoding settings for both live in encoder.PROFILES.
+PREVIEW_MAX_EDGE = int(os.environ.get('PREVIEW_MAX_EDGE', 1280))
+
+# --- Albums ---
+# Photos sent as an album arrive as separate updates sharing a media_group_id.
+# They are collected as records and edited together once a filter is chosen
+# (see sessions.py for the records and their expiry).
+ALBUM_MAX_PHOTOS = 10  # Telegram's limit for one media group
+ALBUM_WORKERS = int(os.environ.get('ALBUM_WORKERS', 4))
+
+# --- Image Processing Functions ---
+def _fetch_file_path(file_id):
+    """Asks Telegram for the download path of file_id and caches it. Returns None on failure."""
+    res = http_client.telegram('getFile', 'GET', params={'file_id': file_id}).json()
+    if not res.get('ok'):
+        print(f"የፋይል ዱካ በማግኘት ላይ ስህተት: {res.get('description')}")
+        return None
+    file_path = res['result']['file_path']
+    original_cache.put_file_path(file_id, file_path)
+    return file_path
+
+def get_original_bytes(file_id):
+    """Returns the encoded original, from the disk cache or a size-capped streaming download.
+
+    A cached file_path may have expired (Telegram keeps download links for
+    an hour), so a failed download with a cached path asks getFile again once.
+    """
+    raw = original_cache.get_bytes(file_id)
+    if raw is None:
+        file_path = original_cache.get_file_path(file_id)
+        cached = file_path is not None
+        if not cached:
+            file_path = _fetch_file_path(file_id)
+            if not file_path:
+                return None
+        try:
+            raw = ingest.download(http_client.telegram_file_url(file_path))
+        except requests.exceptions.RequestException:
+            if not cached:
+                raise
+            original_cache.drop_file_path(file_id)
+            file_path = _fetch_file_path(file_id)
+            if not file_path:
+                return None
+            raw = ingest.download(http_client.telegram_file_url(file_path))
+        original_cache.put_bytes(file_id, raw)
+    return raw
+
+def get_image_from_telegram(file_id):
+    """Downloads an image from Telegram servers using its file_id.
+
+    Results are cached by file_id (see image_cache), so the returned image is
+    shared and must not be modified in place.
+    """
+    image = original_cache.get(file_id)
+    if image is not None:
+        return image
+    try:
+        raw = get_original_bytes(file_id)
+        if raw is None:
+            return None
+        image = ingest.decode(raw)
+        original_cache.put(file_id, image)
+        return image
+    except Exception as e:
+        print(f"ፎቶ በማውረድ ላይ ስህተት: {e}")
+        return None
+
+def get_preview_image(file_id):
+    """Returns a cached proxy of the original, at most PREVIEW_MAX_EDGE on the long edge.
+
+    A decoded full-size original is reused when one is cached; otherwise the
+    original is decoded at reduced scale and never held at full size.
+    """
+    key = (file_id, 'preview')
+    preview = original_cache.get(key)
+    if preview is not None:
+        return preview
+    original = original_cache.get(file_id)
+    if original is not None and max(original.size) <= PREVIEW_MAX_EDGE:
+        return original
+    try:
+        if original is None:
+            raw = get_original_bytes(file_id)
+            if raw is None:
+                return None
+            original = ingest.decode(raw, max_edge=PREVIEW_MAX_EDGE)
+    except Exception as e:
+        print(f"ፎቶ በማውረድ ላይ ስህተት: {e}")
+        return None
+    preview = original
+    if max(original.size) > PREVIEW_MAX_EDGE:
+        preview = original.copy()
+        preview.thumbnail((PREVIEW_MAX_EDGE, PREVIEW_MAX_EDGE), Image.Resampling.LANCZOS)
+    original_cache.put(key, preview)
+    return preview
+
+def apply_adjustment(image, adjustment_type, value):
+    """Applies a single adjustment to an image."""
+    return tiled_renderer.render(compile_program(((adjustment_type, value),)), image)
+
+def render_adjustments(image, steps):
+    """Applies collapsed (tool, value) steps in a single fused pass."""
+    return tiled_renderer.render(compile_program(tuple(steps)), image)
+
+def reapply_adjustments(original_image, adjustments):
+    """Re-applies a list of adjustments to the original image, uncached."""
+    return render_adjustments(original_image, collapse_adjustments(adjustments))
+
+# Caches every rendered preview state per session (keyed by file_id).
+adjustment_engine = AdjustmentEngine(render_adjustments)
+
+metrics.add_collector('photo_bot_original_cache', original_cache.stats)
+metrics.add_collector('photo_bot_render_cache', adjustment_engine.stats)
+metrics.add_collector('photo_bot_tiled_render', tiled_renderer.stats)
+metrics.add_collector('photo_bot_encoder', encoder.stats)
+
+def apply_filter(image, filter_type):
+    """Applies a one-time filter to an image."""
+    return tiled_renderer.render(compile_program((), filter_type), image)
+
+# --- Charging ---
+def charge(storage, user_id, cost, key):
+    """Takes cost credits once per ledger key. Returns (charge_key, balance).
+
+    balance is None if the user cannot pay. charge_key is None if an earlier
+    delivery of the same update already paid, so the caller must stop. A
+    charge that was refunded (charge_key + ':refund') does not count as paid:
+    the retry is charged again under key:2, key:3, ...
+    """
+    charge_key = key
+    for attempt in itertools.count(2):
+        balance, applied = storage.add_credits(user_id, -cost, min_balance=0, key=charge_key)
+        if balance is None or applied:
+            return charge_key, balance
+        if not storage.has_ledger_key(f"{charge_key}:refund"):
+            return None, balance
+        charge_key = f"{key}:{attempt}"
+
+# --- Session Rendering ---
+def upload_preview(chat_id, message_id, session, caption, reply_markup, state):
+    """Renders, encodes and uploads the session's preview. Returns True if it is shown."""
+    preview = get_preview_image(session['file_id'])
+    if not preview:
+        send_telegram_message(chat_id, "ይቅርታ, ዋናውን ፎቶ ማግኘት አልቻልኩም። እባክዎ እንደገና ይሞክሩ።")
+        return False
+    with span('render', variant='preview'):
+        image = adjustment_engine.render((session['file_id'], 'preview'), preview, sessions.session_adjustments(session))
+    return send_or_edit_photo(chat_id, image, caption, message_id=message_id, reply_markup=reply_markup,
+                              profile='preview', source=preview, state=state) is not None
+
+def start_session(update, chat_id, user_id, message):
+    """Charges for a single photo, shows its preview with the main menu and opens a session."""
+    storage = get_storage()
+    # Simplified workflow: Check and deduct credit atomically upon receiving a photo
+    charge_key, balance = charge(storage, user_id, EDIT_COST, f"photo:{update['update_id']}")
+    if balance is None:
+        send_telegram_message(chat_id, NO_CREDIT_MESSAGE)
+        return
+    if charge_key is None:
+        return  # A redelivery of a photo that was already charged and handled
+
+    # If user has credit, proceed
+    file_id = message['photo'][-1]['file_id']
+
+    send_telegram_message(chat_id, "⏳ ፎቶዎን በማዘጋጀት ላይ ነው...")
+
+    image = get_preview_image(file_id)
+    if image:
+        caption = "የማስተካከያ አይነት ይምረጡ።"
+        state = state_id(file_id, 'preview', ())
+        message_id = send_or_edit_photo(chat_id, image, caption, reply_markup=MAIN_MENU, profile='preview', source=image, state=state)
+
+        if message_id:
+            sessions.save_session(user_id, sessions.new_session(file_id, message_id, shown=state))
+        else:
+            storage.add_credits(user_id, EDIT_COST, key=f"{charge_key}:refund") # Refund credit
+            send_telegram_message(chat_id, "❌ ስህተት ተፈጥሯል። ክሬዲትዎ አልተቀነሰም።")
+    else:
+        storage.add_credits(user_id, EDIT_COST, key=f"{charge_key}:refund") # Refund credit
+        send_telegram_message(chat_id, "❌ ይቅርታ, ፎቶዎን ማውረድ አልተቻለም። ክሬዲትዎ አልተቀነሰም።")
+
+def finish_session(callback_query, chat_id, message_id, user_id, session, recipe=None):
+    """Final renders: full resolution, high quality, and the session ends.
+
+    Each one is remembered as the user's last recipe, for albums and /savepreset.
+    """
+    storage = get_storage()
+    data = callback_query['data']
+    original_image = get_image_from_telegram(session['file_id'])
+    if not original_image:
+        answer_callback_query(callback_query['id'])
+        send_telegram_message(chat_id, "ይቅርታ, ዋናውን ፎቶ ማግኘት አልቻልኩም። እባክዎ እንደገና ይሞክሩ።")
+        return
+
+    answer_callback_query(callback_query['id'])
+
+    if data.startswith('filter_'):
+        filter_type = data.split('_')[1]
+        with span('render', variant='full', filter=filter_type):
+            edited_image = apply_filter(original_image, filter_type)
+        send_or_edit_photo(chat_id, edited_image, f"✅ *{filter_type.capitalize()}* ማጣሪያ ተተግብሯል! የመጨረሻው ፎቶዎ ዝግጁ ነው።", message_id=message_id, reply_markup=None, source=original_image)
+        sessions.end_session(user_id)
+        storage.update_user(user_id, {'last_recipe': recipes.make_recipe(filter_type=filter_type)})
+
+    elif recipe:
+        name = data[len('preset_'):]
+        with span('render', variant='full', recipe=name):
+            final_image = tiled_renderer.render(recipes.recipe_program(recipe), original_image)
+        send_or_edit_photo(chat_id, final_image, f"✅ *{name}* ቅንብር ተተግብሯል! የመጨረሻው ፎቶዎ ዝግጁ ነው።", message_id=message_id, reply_markup=None, source=original_image)
+        sessions.end_session(user_id)
+        storage.update_user(user_id, {'last_recipe': recipes.make_recipe(recipe['adjustments'], recipe['filter'])})
+
+    elif data == 'adjust_send':
+        # Rendered once and not cached: the session ends here, and a full-size
+        # state would evict other sessions' previews from the render cache.
+        with span('render', variant='full'):
+            final_image = render_adjustments(original_image, sessions.session_steps(session))
+        send_or_edit_photo(chat_id, final_image, "✅ የእርስዎ የመጨረሻ ፎቶ ዝግጁ ነው!", message_id=message_id, reply_markup=None, source=original_image)
+        sessions.end_session(user_id)
+        storage.update_user(user_id, {'last_recipe': recipes.make_recipe(sessions.session_steps(session))})
+
+# --- Album Editing ---
+def render_album_photo(file_id, program):
+    """Downloads, renders and encodes one album photo. Runs on the album thread pool."""
+    try:
+        original = get_image_from_telegram(file_id)
+        if not original:
+            return None
+        with span('render', variant='album'):
+            image = tiled_renderer.render(program, original)
+        return encoder.encode(image, 'final', source=original, out=io.BytesIO())
+    except Exception as e:
+        print(f"የአልበም ፎቶ በማዘጋጀት ላይ ስህተት: {e}")
+        return None
+
+def edit_album(chat_id, user_id, menu_message_id, media_group_id, recipe, charge_key):
+    """Applies one recipe to every photo of an album and sends them back as one album.
+
+    Credits for the whole album are taken in one atomic step before any work
+    starts; photos that fail are refunded afterwards. charge_key is the
+    ledger key of the charge (the refund uses charge_key + ':refund').
+    """
+    storage = get_storage()
+    album = storage.get_record(sessions.ALBUM_KIND, media_group_id)
+    if (not album or album['user_id'] != user_id or album.get('expires_at', 0) < time.time()
+            or storage.get_record(sessions.ALBUM_CLAIM_KIND, media_group_id)):
+        send_telegram_message(chat_id, "የፎቶ ማስተካከያ ጊዜው አልፎበታል።")
+        return
+    photos = sorted(storage.iter_records(sessions.album_photos_kind(media_group_id)), key=lambda item: int(item[0]))[:ALBUM_MAX_PHOTOS]
+    cost = EDIT_COST * len(photos)
+    charge_key, balance = charge(storage, user_id, cost, charge_key)
+    if balance is None:
+        send_telegram_message(chat_id, NO_CREDIT_MESSAGE)
+        return
+    if charge_key is None:
+        return  # A redelivery of a tap that was already charged
+    if not storage.create_record(sessions.ALBUM_CLAIM_KIND, media_group_id, {'expires_at': album['expires_at']}):
+        storage.add_credits(user_id, cost, key=f"{charge_key}:refund")  # Another tap is already editing this album
+        return
+    edit_message_reply_markup(chat_id, menu_message_id)
+
+    send_telegram_message(chat_id, f"⏳ *{len(photos)}* ፎቶዎችዎን በማዘጋጀት ላይ ነው...")
+    program = recipes.recipe_program(recipe)
+    with ThreadPoolExecutor(max_workers=ALBUM_WORKERS) as pool:
+        results = list(pool.map(lambda item: render_album_photo(item[1]['file_id'], program), photos))
+    encoded = [result for result in results if result]
+    if encoded and send_media_group(chat_id, encoded, f"✅ *{len(encoded)}* ፎቶዎችዎ ዝግጁ ናቸው!"):
+        refund = EDIT_COST * (len(photos) - len(encoded))
+        storage.delete_records(sessions.album_photos_kind(media_group_id), [key for key, _ in photos])
+    else:
+        refund = cost
+        storage.delete_records(sessions.ALBUM_CLAIM_KIND, [media_group_id])  # Let the user try again
+        send_telegram_message(chat_id, "❌ ይቅርታ, አልበሙን ማዘጋጀት አልተቻለም። ክሬዲትዎ አልተቀነሰም። እንደገና ይሞክሩ።",
+                              reply_markup=get_album_menu(media_group_id, user_id, bool((storage.get_user(user_id) or {}).get('last_recipe'))))
+    if refund:
+        storage.add_credits(user_id, refund, key=f"{charge_key}:refund")
@@ -0,0 +1,66 @@
+from storage import get_storage
+
+# color_engine (and with it Pillow) is imported by the functions that need it,
+# so listing and saving presets does not load the image stack.
+
+# --- Constants ---
+MAX_PRESETS = 10  # Saved presets per user
+MAX_NAME_BYTES = 24  # Keeps 'album_<media_group_id>_p_<name>' under Telegram's 64-byte callback limit
+
+# A recipe is {'adjustments': [[tool, value], ...], 'filter': filter_type or None}:
+# the adjustments are applied first, then the filter, in one compiled pass.
+BUILTIN_RECIPES = {
+    'vivid': {'label': "🌟 Vivid", 'adjustments': [['contrast', 1], ['saturation', 1]], 'filter': None},
+    'warm': {'label': "🌅 Warm", 'adjustments': [['brightness', 1], ['warmth', 2]], 'filter': None},
+    'portrait': {'label': "🙂 Portrait", 'adjustments': [['brightness', 1], ['contrast', -1], ['warmth', 1]], 'filter': None},
+    'moody': {'label': "🌙 Moody", 'adjustments': [['brightness', -1]], 'filter': 'cinematic'},
+}
+
+def _kind(user_id):
+    return f"presets:{user_id}"
+
+def make_recipe(adjustments=(), filter_type=None):
+    """A storable recipe from collapsed (tool, value) steps and an optional filter."""
+    if filter_type is not None:
+        from color_engine import FILTER_STEPS
+        filter_type = filter_type if filter_type in FILTER_STEPS else None
+    return {'adjustments': [[tool, value] for tool, value in adjustments], 'filter': filter_type}
+
+def recipe_program(recipe):
+    """The compiled ColorProgram for a recipe; compile_program caches it across calls and users."""
+    from color_engine import compile_program
+    adjustments = tuple((tool, value) for tool, value in recipe.get('adjustments', []))
+    return compile_program(adjustments, recipe.get('filter'))
+
+def check_name(name):
+    """Returns an error message for an unusable preset name, or None."""
+    if not name or len(name.encode()) > MAX_NAME_BYTES:
+        return f"ስሙ ከ1 እስከ {MAX_NAME_BYTES} ፊደላት መሆን አለበት።"
+    if not all(char.isalnum() or char == '-' for char in name):
+        return "ስሙ ፊደላት፣ ቁጥሮች እና - ብቻ መያዝ ይችላል።"
+    if name in BUILTIN_RECIPES:
+        return f"*{name}* የቦቱ ቅንብር ስም ነው፤ ሌላ ስም ይምረጡ።"
+    return None
+
+def get_recipe(user_id, name):
+    """A user's own preset or a built-in recipe by name, or None."""
+    recipe = get_storage().get_record(_kind(user_id), name)
+    return recipe or BUILTIN_RECIPES.get(name)
+
+def list_recipes(user_id):
+    """[(name, label), ...] for the built-in recipes followed by the user's presets."""
+    recipes = [(name, recipe['label']) for name, recipe in BUILTIN_RECIPES.items()]
+    recipes += [(name, f"⭐ {name}") for name, _ in sorted(get_storage().iter_records(_kind(user_id)))]
+    return recipes
+
+def save_recipe(user_id, name, recipe):
+    """Saves or replaces a user's preset. Returns False if the user already has MAX_PRESETS others."""
+    storage = get_storage()
+    existing = [key for key, _ in storage.iter_records(_kind(user_id))]
+    if name not in existing and len(existing) >= MAX_PRESETS:
+        return False
+    storage.put_record(_kind(user_id), name, recipe)
+    return True
+
+def delete_recipe(user_id, name):
+    return get_storage().delete_records(_kind(user_id), [name]) == 1
@@ -0,0 +1,133 @@
+import os
+import time
+import threading
+
+from storage import get_storage
+from adjustments import collapse_adjustments
+
+# --- Environment Variables ---
+SESSION_TTL = int(os.environ.get('SESSION_TTL', 3600))  # Seconds a session lives after its last change
+UNDO_DEPTH = int(os.environ.get('UNDO_DEPTH', 20))
+ALBUM_TTL = int(os.environ.get('ALBUM_TTL', 3600))  # Seconds an album can be edited after its first photo
+
+# --- Constants ---
+SESSION_KIND = 'session'
+ALBUM_KIND = 'album'
+ALBUM_CLAIM_KIND = 'album-claim'
+SWEEP_INTERVAL = 300
+
+# Editing sessions are stored as records (one per user), not inside the user
+# record, so they are not part of every user read and are dropped when they
+# expire. A session is
+#   {'file_id', 'message_id', 'shown', 'expires_at',
+#    'steps': [[tool, net], ...],   # the collapsed adjustments that are rendered
+#    'undo': [[tool, value], ...]}  # the last UNDO_DEPTH raw steps, for undo
+# so it stays the same size however many buttons are pressed.
+#
+# Albums have a marker ('album' record: user_id, chat_id, expires_at), one
+# record per photo (album_photos_kind) and, once a choice is being applied,
+# an 'album-claim' record. The marker is kept until it expires, even after the
+# album was edited, so a late photo of the same album finds it and does not
+# start a second album. All three expire together.
+
+_last_sweep = 0.0
+_sweep_lock = threading.Lock()
+
+def _as_adjustments(pairs):
+    return [{'tool': tool, 'value': value} for tool, value in pairs]
+
+def new_session(file_id, message_id, shown=None):
+    return {'file_id': file_id, 'message_id': message_id, 'shown': shown, 'steps': [], 'undo': []}
+
+def album_photos_kind(media_group_id):
+    return f"album:{media_group_id}"
+
+def get_session(user_id):
+    """The user's live session, or None if there is none or it has expired."""
+    now = time.time()
+    session = get_storage().get_record(SESSION_KIND, user_id)
+    if session and session.get('expires_at', 0) < now:
+        # Only deletes it if it is still expired: another update may have
+        # just started a new session for this user.
+        get_storage().delete_expired(SESSION_KIND, now, keys=[user_id])
+        return None
+    return session
+
+def save_session(user_id, session):
+    """Writes the session and pushes its expiry SESSION_TTL into the future."""
+    session['expires_at'] = time.time() + SESSION_TTL
+    get_storage().put_record(SESSION_KIND, user_id, session)
+
+def end_session(user_id):
+    get_storage().delete_records(SESSION_KIND, [user_id])
+
+def migrate_legacy_session(user_id, user_data):
+    """Moves a session still stored inside the user record into the session store."""
+    legacy = user_data.get('session') or {}
+    if not legacy.get('file_id'):
+        return None
+    session = new_session(legacy['file_id'], legacy.get('message_id'), legacy.get('shown'))
+    for adjustment in legacy.get('adjustments', []):
+        push_step(session, adjustment['tool'], adjustment['value'])
+    save_session(user_id, session)
+    get_storage().update_user(user_id, {'session': {}})
+    return session
+
+# --- Adjustment history ---
+def session_steps(session):
+    """The session's collapsed (tool, net) steps, as used by state_id and compile_program."""
+    return tuple((tool, net) for tool, net in session['steps'])
+
+def session_adjustments(session):
+    """The collapsed steps as {'tool', 'value'} dicts, for AdjustmentEngine.render()."""
+    return _as_adjustments(session['steps'])
+
+def push_step(session, tool, value):
+    session['steps'] = [list(step) for step in collapse_adjustments(_as_adjustments(session['steps'] + [[tool, value]]))]
+    session['undo'] = (session['undo'] + [[tool, value]])[-UNDO_DEPTH:]
+
+def undo_step(session):
+    """Reverts the last raw step. Appending its inverse collapses back to exactly the earlier steps."""
+    if not session['undo']:
+        return False
+    tool, value = session['undo'].pop()
+    session['steps'] = [list(step) for step in collapse_adjustments(_as_adjustments(session['steps'] + [[tool, -value]]))]
+    return True
+
+def reset_steps(session):
+    session['steps'] = []
+    session['undo'] = []
+
+# --- Expiry ---
+def sweep_expired():
+    """Deletes every expired session and album and returns how many there were."""
+    storage = get_storage()
+    now = time.time()
+    swept = storage.delete_expired(SESSION_KIND, now)
+    expired_albums = [key for key, album in storage.iter_records(ALBUM_KIND) if album.get('expires_at', 0) < now]
+    for media_group_id in expired_albums:
+        storage.delete_expired(album_photos_kind(media_group_id), now)
+        storage.delete_expired(ALBUM_CLAIM_KIND, now, keys=[media_group_id])
+    if expired_albums:
+        # The marker goes last, so an interrupted sweep finds the album again.
+        swept += storage.delete_expired(ALBUM_KIND, now, keys=expired_albums)
+    return swept
+
+def maybe_sweep():
+    """Starts a background sweep at most every SWEEP_INTERVAL seconds. Cheap to call on every update."""
+    global _last_sweep
+    with _sweep_lock:
+        now = time.time()
+        if now - _last_sweep < SWEEP_INTERVAL:
+            return
+        _last_sweep = now
+
+    def target():
+        try:
+            swept = sweep_expired()
+            if swept:
+                print(f"{swept} ያለፈባቸው sessions እና albums ተሰርዘዋል።")
+        except Exception as e:
+            print(f"Session sweep ላይ ስህተት: {e}")
+
+    threading.Thread(target=target, daemon=True).start()
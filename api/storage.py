@@ -0,0 +1,660 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+import requests
+
+import http_client
+
+# --- Environment Variables ---
+JSONBIN_API_KEY = os.environ.get('JSONBIN_API_KEY')
+JSONBIN_BIN_ID = os.environ.get('JSONBIN_BIN_ID')
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'jsonbin')  # 'jsonbin', or 'sqlite' only where /tmp persists
+SQLITE_PATH = os.environ.get('SQLITE_PATH', '/tmp/photo_bot.db')
+
+# --- Constants ---
+SNAPSHOT_EVERY = 100  # Ledger entries per user between balance snapshots
+LEDGER_KEY_TTL = 2 * 24 * 3600  # How long JSONBin keeps idempotency keys (Telegram stops redelivering long before)
+USER_INDEXES = ('task_group', 'invited_by')
+
+# --- Legacy Whole-Document Functions (JSONBin.io) ---
+def get_db():
+    """Fetches the entire database from JSONBin.io ONCE."""
+    if not JSONBIN_BIN_ID or not JSONBIN_API_KEY:
+        print("ስህተት: የJSONBin ኤፒአይ ቁልፍ ወይም የቢን መለያ ጠፍቷል።")
+        raise Exception("JSONBin API Key or Bin ID is missing.")
+    headers = {'X-Master-Key': JSONBIN_API_KEY, 'X-Bin-Meta': 'false'}
+    try:
+        req = http_client.jsonbin('GET', http_client.jsonbin_url(JSONBIN_BIN_ID, latest=True), headers=headers)
+        req.raise_for_status()
+        return req.json()
+    except requests.exceptions.RequestException as e:
+        print(f"ዳታቤዙን በማምጣት ላይ ስህተት ተፈጥሯል: {e}")
+        return {'users': {}} # On failure, return a valid empty structure
+
+def update_db(data):
+    """Updates the entire database on JSONBin.io ONCE."""
+    if not JSONBIN_BIN_ID or not JSONBIN_API_KEY:
+        print("ስህተት: የJSONBin ኤፒአይ ቁልፍ ወይም የቢን መለያ ጠፍቷል።")
+        raise Exception("JSONBin API Key or Bin ID is missing.")
+    headers = {'Content-Type': 'application/json', 'X-Master-Key': JSONBIN_API_KEY}
+    try:
+        req = http_client.jsonbin('PUT', http_client.jsonbin_url(JSONBIN_BIN_ID), json=data, headers=headers)
+        req.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"ዳታቤዙን በማዘመን ላይ ስህተት ተፈጥሯል: {e}")
+
+# --- Storage Interface ---
+class Storage(ABC):
+    """Per-user record storage. Credits are only changed through add_credits()."""
+
+    @abstractmethod
+    def get_user(self, user_id):
+        """Returns a copy of one user record, or None if it does not exist."""
+
+    @abstractmethod
+    def create_user(self, user_id, data):
+        """Creates a user record. Returns False if the user already exists."""
+
+    @abstractmethod
+    def update_user(self, user_id, fields):
+        """Merges top-level fields into a user record. Returns False if missing."""
+
+    @abstractmethod
+    def add_credits(self, user_id, delta, min_balance=None, key=None):
+        """Atomically adds delta to a user's credits. Returns (balance, applied).
+
+        Every change is appended to the credit ledger. key is an idempotency
+        key (e.g. 'photo:<update_id>'): if a change with that key was already
+        applied, nothing changes and (the balance recorded with it, False) is
+        returned, so a redelivered update cannot charge or award twice.
+        Returns (None, False) if the user does not exist or if the new balance
+        would drop below min_balance.
+        """
+
+    @abstractmethod
+    def ledger_balance(self, user_id):
+        """Recomputes a balance from the ledger (latest snapshot plus later entries), for audits."""
+
+    @abstractmethod
+    def has_ledger_key(self, key):
+        """Whether a change with this idempotency key was applied."""
+
+    @abstractmethod
+    def count_users(self):
+        """Returns how many users exist."""
+
+    @abstractmethod
+    def iter_user_ids(self):
+        """Returns every user id."""
+
+    # Users are indexed by the group of their unfinished add_task, by who
+    # invited them and by last activity, and the admin totals are updated
+    # with every user and credit change, so no handler has to scan all users.
+    @abstractmethod
+    def find_users(self, index, value):
+        """Returns the ids of users whose indexed field equals value.
+
+        index is 'task_group' (the group of an unfinished add_task) or
+        'invited_by'.
+        """
+
+    @abstractmethod
+    def touch_user(self, user_id, at):
+        """Sets the user's last-activity time. Returns False if the user is missing."""
+
+    @abstractmethod
+    def add_task_members(self, user_id, group_id, count, target):
+        """Atomically adds count to the user's unfinished add_task in group_id,
+        completing it once added_count reaches target.
+
+        Returns (task, completed), where completed is True only for the call
+        that completed the task, or (None, False) if there is no such task.
+        """
+
+    @abstractmethod
+    def user_stats(self, active_since):
+        """Returns {'users', 'active_users', 'credits'}: all users, users active
+        since active_since and the credits they hold between them."""
+
+    # Records are small JSON values grouped by kind (e.g. broadcast jobs),
+    # kept outside the user records.
+    @abstractmethod
+    def get_record(self, kind, key):
+        """Returns a copy of one record's value, or None if it does not exist."""
+
+    @abstractmethod
+    def put_records(self, kind, items):
+        """Writes {key: value} for one kind in a single write."""
+
+    def put_record(self, kind, key, value):
+        self.put_records(kind, {key: value})
+
+    @abstractmethod
+    def create_record(self, kind, key, value):
+        """Writes a record unless the key exists. Returns False if it already did."""
+
+    @abstractmethod
+    def update_record_if(self, kind, key, field, expected, value):
+        """Replaces a record with value if its `field` still equals expected,
+        in one atomic step (a compare-and-set, e.g. for leases). Returns False
+        if the record is missing or the field has changed."""
+
+    @abstractmethod
+    def delete_records(self, kind, keys):
+        """Deletes the given keys and returns how many of them existed."""
+
+    @abstractmethod
+    def delete_expired(self, kind, now, keys=None):
+        """Deletes the records of one kind (or just `keys`) whose 'expires_at'
+        is before now, checking and deleting in one atomic step so a record
+        rewritten in between survives. Returns how many were deleted."""
+
+    @abstractmethod
+    def iter_records(self, kind):
+        """Returns [(key, value), ...] for one kind."""
+
+    def refresh(self):
+        """Drops any state cached from a previous update."""
+
+def _check_fields(fields):
+    if 'credits' in fields:
+        raise ValueError("credits must be changed with add_credits()")
+    if 'last_active' in fields:
+        raise ValueError("last_active must be changed with touch_user()")
+
+def _index_values(data):
+    """The indexed fields of a user record, as {'task_group', 'invited_by'}."""
+    task = data.get('add_task') or {}
+    invited_by = data.get('invited_by')
+    return {'task_group': task.get('group_id') if not task.get('completed') else None,
+            'invited_by': str(invited_by) if invited_by is not None else None}
+
+def _add_task_members(data, group_id, count, target):
+    """add_task_members() on a user record, in place."""
+    task = data.get('add_task') or {}
+    if task.get('group_id') != group_id or task.get('completed'):
+        return None, False
+    task['added_count'] = task.get('added_count', 0) + count
+    task['completed'] = task['added_count'] >= target
+    data['add_task'] = task
+    return task, task['completed']
+
+# --- SQLite Backend ---
+class SQLiteStorage(Storage):
+    """Local file-backed storage. Every call reads or writes a single row.
+
+    users.credits is the ledger's running balance, written in the same
+    transaction as the ledger entry, so balance reads stay a single row.
+    The indexed user fields are copied into their own indexed columns, and
+    user_stats holds the user and credit totals.
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                "user_id TEXT PRIMARY KEY, credits INTEGER NOT NULL DEFAULT 0, data TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS records ("
+                "kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (kind, key))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ledger ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, key TEXT UNIQUE, "
+                "delta INTEGER NOT NULL, balance INTEGER NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ledger_user ON ledger (user_id, seq)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS credit_snapshots ("
+                "user_id TEXT PRIMARY KEY, seq INTEGER NOT NULL, balance INTEGER NOT NULL)"
+            )
+            self._create_user_indexes(conn)
+
+    def _create_user_indexes(self, conn):
+        """Adds the index columns and totals, filling them in for databases created before them."""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+        if 'task_group' not in columns:
+            conn.execute("ALTER TABLE users ADD COLUMN task_group INTEGER")
+            conn.execute("ALTER TABLE users ADD COLUMN invited_by TEXT")
+            conn.execute("ALTER TABLE users ADD COLUMN last_active REAL")
+            conn.execute(
+                "UPDATE users SET invited_by = json_extract(data, '$.invited_by'), task_group = CASE "
+                "WHEN json_extract(data, '$.add_task.completed') THEN NULL ELSE json_extract(data, '$.add_task.group_id') END"
+            )
+        conn.execute("CREATE INDEX IF NOT EXISTS users_task_group ON users (task_group) WHERE task_group IS NOT NULL")
+        conn.execute("CREATE INDEX IF NOT EXISTS users_invited_by ON users (invited_by) WHERE invited_by IS NOT NULL")
+        conn.execute("CREATE INDEX IF NOT EXISTS users_last_active ON users (last_active)")
+        conn.execute("CREATE TABLE IF NOT EXISTS user_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO user_stats (name, value) SELECT 'users', COUNT(*) FROM users")
+        conn.execute("INSERT OR IGNORE INTO user_stats (name, value) SELECT 'credits', COALESCE(SUM(credits), 0) FROM users")
+
+    def _conn(self):
+        """Returns this thread's connection (sqlite3 connections are not thread-safe)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._conn())
+
+    def get_user(self, user_id):
+        row = self._conn().execute("SELECT credits, last_active, data FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+        if not row:
+            return None
+        user = json.loads(row[2])
+        user['credits'] = row[0]
+        user['last_active'] = row[1] or 0
+        return user
+
+    def create_user(self, user_id, data):
+        data = dict(data)
+        credits = data.pop('credits', 0)
+        data.pop('last_active', None)
+        indexed = _index_values(data)
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO users (user_id, credits, data, task_group, invited_by, last_active) VALUES (?, ?, ?, ?, ?, ?)",
+                (str(user_id), credits, json.dumps(data), indexed['task_group'], indexed['invited_by'], time.time()),
+            )
+            if cur.rowcount == 1:
+                self._add_stats(conn, users=1, credits=credits)
+                if credits:
+                    self._append_ledger(conn, user_id, f"open:{user_id}", credits, credits)
+        return cur.rowcount == 1
+
+    def update_user(self, user_id, fields):
+        _check_fields(fields)
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+            if not row:
+                return False
+            data = json.loads(row[0])
+            data.update(fields)
+            indexed = _index_values(data)
+            conn.execute(
+                "UPDATE users SET data = ?, task_group = ?, invited_by = ? WHERE user_id = ?",
+                (json.dumps(data), indexed['task_group'], indexed['invited_by'], str(user_id)),
+            )
+        return True
+
+    def add_task_members(self, user_id, group_id, count, target):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+            if not row:
+                return None, False
+            data = json.loads(row[0])
+            task, completed = _add_task_members(data, group_id, count, target)
+            if task is not None:
+                conn.execute(
+                    "UPDATE users SET data = ?, task_group = ? WHERE user_id = ?",
+                    (json.dumps(data), _index_values(data)['task_group'], str(user_id)),
+                )
+            return task, completed
+
+    def _add_stats(self, conn, **deltas):
+        conn.executemany("UPDATE user_stats SET value = value + ? WHERE name = ?",
+                         [(delta, name) for name, delta in deltas.items() if delta])
+
+    def add_credits(self, user_id, delta, min_balance=None, key=None):
+        with self._transaction() as conn:
+            if key is not None:
+                row = conn.execute("SELECT balance FROM ledger WHERE key = ?", (key,)).fetchone()
+                if row:
+                    return row[0], False
+            if min_balance is None:
+                cur = conn.execute("UPDATE users SET credits = credits + ? WHERE user_id = ?", (delta, str(user_id)))
+            else:
+                cur = conn.execute(
+                    "UPDATE users SET credits = credits + ? WHERE user_id = ? AND credits + ? >= ?",
+                    (delta, str(user_id), delta, min_balance),
+                )
+            if cur.rowcount != 1:
+                return None, False
+            balance = conn.execute("SELECT credits FROM users WHERE user_id = ?", (str(user_id),)).fetchone()[0]
+            self._add_stats(conn, credits=delta)
+            self._append_ledger(conn, user_id, key, delta, balance)
+            return balance, True
+
+    def _append_ledger(self, conn, user_id, key, delta, balance):
+        seq = conn.execute(
+            "INSERT INTO ledger (user_id, key, delta, balance, created_at) VALUES (?, ?, ?, ?, ?)",
+            (str(user_id), key, delta, balance, time.time()),
+        ).lastrowid
+        snapshot = conn.execute("SELECT seq FROM credit_snapshots WHERE user_id = ?", (str(user_id),)).fetchone()
+        since = conn.execute(
+            "SELECT COUNT(*) FROM ledger WHERE user_id = ? AND seq > ?", (str(user_id), snapshot[0] if snapshot else 0)
+        ).fetchone()[0]
+        if since >= SNAPSHOT_EVERY:
+            conn.execute(
+                "INSERT OR REPLACE INTO credit_snapshots (user_id, seq, balance) VALUES (?, ?, ?)",
+                (str(user_id), seq, balance),
+            )
+
+    def has_ledger_key(self, key):
+        return self._conn().execute("SELECT 1 FROM ledger WHERE key = ?", (key,)).fetchone() is not None
+
+    def ledger_balance(self, user_id):
+        conn = self._conn()
+        snapshot = conn.execute("SELECT seq, balance FROM credit_snapshots WHERE user_id = ?", (str(user_id),)).fetchone()
+        seq, balance = snapshot or (0, 0)
+        tail = conn.execute(
+            "SELECT COALESCE(SUM(delta), 0) FROM ledger WHERE user_id = ? AND seq > ?", (str(user_id), seq)
+        ).fetchone()[0]
+        return balance + tail
+
+    def count_users(self):
+        return self._conn().execute("SELECT value FROM user_stats WHERE name = 'users'").fetchone()[0]
+
+    def iter_user_ids(self):
+        rows = self._conn().execute("SELECT user_id FROM users").fetchall()
+        return [row[0] for row in rows]
+
+    def find_users(self, index, value):
+        if index not in USER_INDEXES:
+            raise ValueError(f"no user index named {index}")
+        value = str(value) if index == 'invited_by' else value
+        rows = self._conn().execute(f"SELECT user_id FROM users WHERE {index} = ?", (value,)).fetchall()
+        return [row[0] for row in rows]
+
+    def touch_user(self, user_id, at):
+        cur = self._conn().execute("UPDATE users SET last_active = ? WHERE user_id = ?", (at, str(user_id)))
+        return cur.rowcount == 1
+
+    def user_stats(self, active_since):
+        conn = self._conn()
+        stats = dict(conn.execute("SELECT name, value FROM user_stats").fetchall())
+        active = conn.execute("SELECT COUNT(*) FROM users WHERE last_active >= ?", (active_since,)).fetchone()[0]
+        return {'users': stats['users'], 'active_users': active, 'credits': stats['credits']}
+
+    def get_record(self, kind, key):
+        row = self._conn().execute("SELECT value FROM records WHERE kind = ? AND key = ?", (kind, str(key))).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_records(self, kind, items):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO records (kind, key, value) VALUES (?, ?, ?)",
+                [(kind, str(key), json.dumps(value)) for key, value in items.items()],
+            )
+
+    def create_record(self, kind, key, value):
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO records (kind, key, value) VALUES (?, ?, ?)",
+                (kind, str(key), json.dumps(value)),
+            )
+        return cur.rowcount == 1
+
+    def update_record_if(self, kind, key, field, expected, value):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT value FROM records WHERE kind = ? AND key = ?", (kind, str(key))).fetchone()
+            if not row or json.loads(row[0]).get(field) != expected:
+                return False
+            conn.execute("UPDATE records SET value = ? WHERE kind = ? AND key = ?", (json.dumps(value), kind, str(key)))
+            return True
+
+    def delete_records(self, kind, keys):
+        with self._transaction() as conn:
+            cur = conn.executemany("DELETE FROM records WHERE kind = ? AND key = ?", [(kind, str(key)) for key in keys])
+        return cur.rowcount
+
+    def delete_expired(self, kind, now, keys=None):
+        expired = "kind = ? AND COALESCE(json_extract(value, '$.expires_at'), 0) < ?"
+        with self._transaction() as conn:
+            if keys is None:
+                cur = conn.execute(f"DELETE FROM records WHERE {expired}", (kind, now))
+            else:
+                cur = conn.executemany(f"DELETE FROM records WHERE {expired} AND key = ?", [(kind, now, str(key)) for key in keys])
+        return cur.rowcount
+
+    def iter_records(self, kind):
+        rows = self._conn().execute("SELECT key, value FROM records WHERE kind = ?", (kind,)).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+class _Transaction:
+    """Runs the block inside BEGIN IMMEDIATE so read-modify-write is atomic."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+# --- JSONBin Backend (Compatibility) ---
+class JsonBinStorage(Storage):
+    """Per-key API on top of the legacy single JSONBin document.
+
+    The document is fetched at most once per update (see refresh()) and is
+    written back on every change, so concurrent writers can still overwrite
+    each other. Use the SQLite backend where that matters.
+
+    A user's credits field is the balance; only keyed ledger entries are
+    kept (as 'ledger' records), for LEDGER_KEY_TTL, since the whole ledger
+    would grow the document that every update downloads.
+
+    The user and credit totals are kept in the document's 'stats'. Index
+    lookups scan the users in memory: the whole document is downloaded
+    anyway, and index maps would only make it larger.
+    """
+
+    def __init__(self):
+        self._db = None
+        self._lock = threading.RLock()
+
+    def _users(self):
+        if self._db is None:
+            self._db = get_db()
+        return self._db.setdefault('users', {})
+
+    def _save(self):
+        update_db(self._db)
+
+    def refresh(self):
+        with self._lock:
+            self._db = None
+
+    def get_user(self, user_id):
+        with self._lock:
+            user = self._users().get(str(user_id))
+            return json.loads(json.dumps(user)) if user else None
+
+    def create_user(self, user_id, data):
+        with self._lock:
+            users = self._users()
+            if str(user_id) in users:
+                return False
+            stats = self._stats()
+            users[str(user_id)] = dict(data, last_active=time.time())
+            stats['users'] += 1
+            stats['credits'] += data.get('credits', 0)
+            self._save()
+            return True
+
+    def _stats(self):
+        """The document's running totals, computed once for documents written before they existed."""
+        users = self._users()
+        if 'stats' not in self._db:
+            self._db['stats'] = {'users': len(users), 'credits': sum(user.get('credits', 0) for user in users.values())}
+        return self._db['stats']
+
+    def update_user(self, user_id, fields):
+        _check_fields(fields)
+        with self._lock:
+            user = self._users().get(str(user_id))
+            if not user:
+                return False
+            user.update(fields)
+            self._save()
+            return True
+
+    def add_credits(self, user_id, delta, min_balance=None, key=None):
+        with self._lock:
+            ledger = self._records('ledger')
+            if key is not None and key in ledger:
+                return ledger[key]['balance'], False
+            user = self._users().get(str(user_id))
+            if not user:
+                return None, False
+            balance = user.get('credits', 0) + delta
+            if min_balance is not None and balance < min_balance:
+                return None, False
+            # Before the balance changes: a missing stats block is computed from the current balances.
+            stats = self._stats()
+            user['credits'] = balance
+            stats['credits'] += delta
+            if key is not None:
+                ledger = self._records('ledger', create=True)
+                now = time.time()
+                for old_key in [k for k, entry in ledger.items() if entry['at'] < now - LEDGER_KEY_TTL]:
+                    del ledger[old_key]
+                ledger[key] = {'user_id': str(user_id), 'delta': delta, 'balance': balance, 'at': now}
+            self._save()
+            return balance, True
+
+    def has_ledger_key(self, key):
+        with self._lock:
+            return key in self._records('ledger')
+
+    def ledger_balance(self, user_id):
+        # Only recent keyed entries are kept, so the stored balance is the snapshot.
+        user = self.get_user(user_id)
+        return user.get('credits', 0) if user else 0
+
+    def count_users(self):
+        with self._lock:
+            return self._stats()['users']
+
+    def iter_user_ids(self):
+        with self._lock:
+            return list(self._users().keys())
+
+    def find_users(self, index, value):
+        if index not in USER_INDEXES:
+            raise ValueError(f"no user index named {index}")
+        value = str(value) if index == 'invited_by' else value
+        with self._lock:
+            return [user_id for user_id, user in self._users().items() if _index_values(user)[index] == value]
+
+    def touch_user(self, user_id, at):
+        with self._lock:
+            user = self._users().get(str(user_id))
+            if not user:
+                return False
+            user['last_active'] = at
+            self._save()
+            return True
+
+    def add_task_members(self, user_id, group_id, count, target):
+        with self._lock:
+            user = self._users().get(str(user_id))
+            if not user:
+                return None, False
+            task, completed = _add_task_members(user, group_id, count, target)
+            if task is not None:
+                self._save()
+            return json.loads(json.dumps(task)), completed
+
+    def user_stats(self, active_since):
+        with self._lock:
+            stats = self._stats()
+            active = sum(1 for user in self._users().values() if user.get('last_active') is not None and user['last_active'] >= active_since)
+            return {'users': stats['users'], 'active_users': active, 'credits': stats['credits']}
+
+    def _records(self, kind, create=False):
+        """One kind's records. Only writers create the kind, so reads of a kind
+        that was never written do not add empty entries to the document."""
+        self._users()  # Loads the document
+        if not create:
+            return self._db.get('records', {}).get(kind, {})
+        return self._db.setdefault('records', {}).setdefault(kind, {})
+
+    def get_record(self, kind, key):
+        with self._lock:
+            value = self._records(kind).get(str(key))
+            return json.loads(json.dumps(value)) if value is not None else None
+
+    def put_records(self, kind, items):
+        with self._lock:
+            self._records(kind, create=True).update({str(key): value for key, value in items.items()})
+            self._save()
+
+    def create_record(self, kind, key, value):
+        with self._lock:
+            records = self._records(kind, create=True)
+            if str(key) in records:
+                return False
+            records[str(key)] = value
+            self._save()
+            return True
+
+    def update_record_if(self, kind, key, field, expected, value):
+        with self._lock:
+            records = self._records(kind)
+            current = records.get(str(key))
+            if current is None or current.get(field) != expected:
+                return False
+            records[str(key)] = value
+            self._save()
+            return True
+
+    def delete_records(self, kind, keys):
+        with self._lock:
+            records = self._records(kind)
+            deleted = sum(records.pop(str(key), None) is not None for key in keys)
+            if not deleted:
+                return 0
+            if not records:
+                self._db['records'].pop(kind, None)
+            self._save()
+            return deleted
+
+    def delete_expired(self, kind, now, keys=None):
+        with self._lock:
+            records = self._records(kind)
+            candidates = records if keys is None else [str(key) for key in keys if str(key) in records]
+            expired = [key for key in candidates if records[key].get('expires_at', 0) < now]
+            if not expired:
+                return 0
+            return self.delete_records(kind, expired)
+
+    def iter_records(self, kind):
+        with self._lock:
+            return json.loads(json.dumps(list(self._records(kind).items())))
+
+# --- Backend Selection ---
+_storage = None
+_storage_lock = threading.Lock()
+
+def get_storage():
+    """Returns the process-wide storage backend, creating it on first use.
+
+    SQLite is used only when STORAGE_BACKEND=sqlite is set: on a serverless
+    instance its file is temporary and not shared, so falling back to it
+    would lose users and credits silently. Without JSONBin credentials the
+    JSONBin backend fails on first use, as get_db() does.
+    """
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            if STORAGE_BACKEND == 'sqlite':
+                _storage = SQLiteStorage()
+            elif STORAGE_BACKEND == 'jsonbin':
+                _storage = JsonBinStorage()
+            else:
+                raise ValueError(f"unknown STORAGE_BACKEND {STORAGE_BACKEND!r}")
+        return _storage
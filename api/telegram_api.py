@@ -0,0 +1,110 @@
+import json
+import requests
+
+import http_client
+from media_cache import media_cache
+
+# Text-only helpers for the Telegram Bot API. Nothing here imports Pillow:
+# send_or_edit_photo() loads the encoder only when it is given an image to upload.
+
+def send_telegram_message(chat_id, text, reply_markup=None):
+    """Sends a text message using the Telegram Bot API."""
+    payload = {'chat_id': chat_id, 'text': text, 'parse_mode': 'Markdown'}
+    if reply_markup:
+        payload['reply_markup'] = json.dumps(reply_markup)
+    try:
+        http_client.telegram('sendMessage', json=payload)
+    except Exception as e:
+        print(f"መልዕክት በመላክ ላይ ስህተት ተፈጥሯል: {e}")
+
+def answer_callback_query(callback_query_id, text=None):
+    """Answers a callback query to remove the loading state on the button."""
+    payload = {'callback_query_id': callback_query_id}
+    if text:
+        payload['text'] = text
+    try:
+        http_client.telegram('answerCallbackQuery', json=payload)
+    except Exception as e:
+        print(f"Callback query በመመለስ ላይ ስህተት: {e}")
+
+def edit_message_reply_markup(chat_id, message_id):
+    """Edits the reply markup of a message to remove the buttons."""
+    payload = {'chat_id': chat_id, 'message_id': message_id, 'reply_markup': json.dumps({'inline_keyboard': []})}
+    try:
+        http_client.telegram('editMessageReplyMarkup', json=payload)
+    except Exception as e:
+        print(f"Reply markup በማስተካከል ላይ ስህተት: {e}")
+
+def edit_message_caption(chat_id, message_id, caption, reply_markup=None):
+    """Edits only the caption and keyboard of a photo message. Returns True on success."""
+    payload = {'chat_id': chat_id, 'message_id': message_id, 'caption': caption, 'parse_mode': 'Markdown',
+               'reply_markup': json.dumps(reply_markup if reply_markup is not None else {'inline_keyboard': []})}
+    try:
+        response = http_client.telegram('editMessageCaption', json=payload)
+        # Pressing the button for the menu already on screen is not an error for us.
+        return response.ok or 'message is not modified' in response.text
+    except Exception as e:
+        print(f"Caption በማስተካከል ላይ ስህተት: {e}")
+        return False
+
+def send_or_edit_photo(chat_id, image, caption, message_id=None, reply_markup=None, profile='final', source=None, state=None):
+    """Sends or edits a photo message with an inline keyboard.
+
+    image is either a PIL image, which is encoded with the given encoder
+    profile ('preview' or 'final') and uploaded, or the Telegram file_id of
+    a photo uploaded earlier. source is the decoded original whose colour
+    profile and orientation the upload keeps. When state is given, the
+    file_id Telegram assigns to the upload is remembered in media_cache.
+    """
+    if isinstance(image, str):
+        media_ref, files = image, None
+    else:
+        from encoder import encoder
+        files, encoded = encoder.encode(image, profile, source=source)
+        media_ref, filename = None, encoded['filename']
+
+    final_reply_markup = reply_markup if reply_markup is not None else {'inline_keyboard': []}
+
+    try:
+        if message_id:
+            media = {'type': 'photo', 'media': media_ref or f'attach://{filename}', 'caption': caption, 'parse_mode': 'Markdown'}
+            data = {'chat_id': chat_id, 'message_id': message_id, 'media': json.dumps(media), 'reply_markup': json.dumps(final_reply_markup)}
+            response = http_client.telegram('editMessageMedia', data=data, files={filename: (filename, files, encoded['mime_type'])} if files else None)
+        else:
+            data = {'chat_id': chat_id, 'caption': caption, 'parse_mode': 'Markdown', 'reply_markup': json.dumps(final_reply_markup)}
+            if files:
+                response = http_client.telegram('sendPhoto', files={'photo': (filename, files, encoded['mime_type'])}, data=data)
+            else:
+                response = http_client.telegram('sendPhoto', data=dict(data, photo=media_ref))
+        response.raise_for_status()
+        media_cache.record('file_id_reuses' if media_ref else 'uploads')
+        result = response.json().get('result')
+        if isinstance(result, dict):
+            if state and files and result.get('photo'):
+                media_cache.put(state, result['photo'][-1]['file_id'])
+            return result.get('message_id', message_id)
+        return message_id
+    except requests.exceptions.RequestException as e:
+        print(f"ፎቶ በመላክ/በማስተካከል ላይ ስህተት ተፈጥሯል: {e} - Response: {e.response.text if e.response is not None else 'N/A'}")
+    return None
+
+def send_media_group(chat_id, items, caption):
+    """Uploads encoded photos as one album; items are (buffer, info) pairs from encoder.encode()."""
+    media, files = [], {}
+    for index, (buffer, info) in enumerate(items):
+        name = f"photo{index}"
+        media.append({'type': 'photo', 'media': f'attach://{name}'})
+        files[name] = (info['filename'], buffer, info['mime_type'])
+    media[0].update(caption=caption, parse_mode='Markdown')
+    try:
+        if len(items) == 1:
+            # A media group needs at least two items.
+            data = {'chat_id': chat_id, 'caption': caption, 'parse_mode': 'Markdown'}
+            response = http_client.telegram('sendPhoto', data=data, files={'photo': files['photo0']})
+        else:
+            response = http_client.telegram('sendMediaGroup', data={'chat_id': chat_id, 'media': json.dumps(media)}, files=files)
+        response.raise_for_status()
+        return True
+    except requests.exceptions.RequestException as e:
+        print(f"አልበም በመላክ ላይ ስህተት: {e} - Response: {e.response.text if e.response is not None else 'N/A'}")
+        return False
@@ -0,0 +1,123 @@
+import os
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from PIL import Image
+
+from color_engine import render_plan
+
+# Tiled rendering.
+#
+# Large renders are cut into horizontal strips, one per pool process. The
+# colour plan (LUT or matrix) is computed once from the whole image, so the
+# strips only differ in the convolutions at their edges: each strip is read
+# with program.halo extra rows above and below, and those rows are cropped
+# off again, which makes the reassembled image identical to a single-process
+# render. Pixels travel through shared memory rather than being pickled, so
+# the only copies are into and out of the shared blocks. Only programs that
+# end in a convolution are worth it: a colour-only pass is a single memory-
+# bound LUT or matrix pass that is faster than copying the image around (see
+# tools/bench_tiles.py). Those, small images, non-RGB images and programs
+# that cannot be fused are rendered in-process as before.
+
+# --- Environment Variables ---
+RENDER_PROCESSES = int(os.environ.get('RENDER_PROCESSES', min(4, os.cpu_count() or 1)))
+TILE_MIN_PIXELS = int(os.environ.get('TILE_MIN_PIXELS', 4000000))
+
+def _render_strip(source_name, target_name, width, rows, out_mode, plan, convolution_steps):
+    """Runs in a pool process: renders rows (padded_top, top, bottom, padded_bottom) of the source."""
+    padded_top, top, bottom, padded_bottom = rows
+    source, target = shared_memory.SharedMemory(name=source_name), shared_memory.SharedMemory(name=target_name)
+    try:
+        # RGB is unpacked into Pillow's own 4-byte layout, so this copies rather than maps the block.
+        strip = Image.frombuffer('RGB', (width, padded_bottom - padded_top),
+                                 source.buf[padded_top * width * 3:padded_bottom * width * 3], 'raw', 'RGB', 0, 1)
+        rendered = memoryview(render_plan(strip, plan, convolution_steps).tobytes())
+        row = width * len(out_mode)
+        target.buf[top * row:bottom * row] = rendered[(top - padded_top) * row:(bottom - padded_top) * row]
+        del strip, rendered
+    finally:
+        source.close()
+        target.close()
+
+class TiledRenderer:
+    """Renders compiled ColorPrograms across a process pool started on first use."""
+
+    def __init__(self, processes=RENDER_PROCESSES, min_pixels=TILE_MIN_PIXELS):
+        self.processes = processes
+        self.min_pixels = min_pixels
+        self.tiled = 0
+        self.single = 0
+        self.failures = 0
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None and self.processes > 1:
+                # spawn, not fork: forking a process that already runs threads can deadlock.
+                context = multiprocessing.get_context('spawn')
+                self._pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=context)
+            return self._pool
+
+    def should_tile(self, program, image):
+        return (self.processes > 1 and program.fusable and program.convolution_steps
+                and image.mode == 'RGB' and image.width * image.height >= self.min_pixels)
+
+    def render(self, program, image):
+        """Same result as program.render(image), computed in strips when the image is large."""
+        if self.should_tile(program, image):
+            try:
+                result = self.render_tiled(program, image)
+                self.tiled += 1
+                return result
+            except (OSError, BrokenProcessPool) as e:
+                # Hosts without working semaphores or fork/spawn end up here; stay single-process.
+                print(f"Tiled rendering ላይ ስህተት, ወደ ነጠላ ሂደት ተመልሷል: {e}")
+                self.failures += 1
+                self.close()
+                self.processes = 0
+        self.single += 1
+        return program.render(image)
+
+    def render_tiled(self, program, image):
+        """Renders in strips across the pool, whatever the image size or program."""
+        pool = self._get_pool()
+        plan = program.plan(image)
+        out_mode = plan[1] if plan and plan[0] == 'convert' else 'RGB'
+        width, height = image.size
+        strips = min(self.processes, height)
+        bounds = [height * i // strips for i in range(strips + 1)]
+        source = shared_memory.SharedMemory(create=True, size=width * height * 3)
+        target = shared_memory.SharedMemory(create=True, size=width * height * len(out_mode))
+        try:
+            source.buf[:width * height * 3] = image.tobytes()
+            futures = []
+            for top, bottom in zip(bounds, bounds[1:]):
+                rows = (max(0, top - program.halo), top, bottom, min(height, bottom + program.halo))
+                futures.append(pool.submit(_render_strip, source.name, target.name, width, rows,
+                                           out_mode, plan, program.convolution_steps))
+            for future in futures:
+                future.result()
+            return Image.frombuffer(out_mode, image.size, target.buf[:width * height * len(out_mode)], 'raw', out_mode, 0, 1).copy()
+        finally:
+            source.close()
+            source.unlink()
+            target.close()
+            target.unlink()
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def stats(self):
+        return {'processes': self.processes, 'tiled': self.tiled, 'single': self.single, 'failures': self.failures}
+
+# Shared by every request handled in this worker process.
+tiled_renderer = TiledRenderer()
+atexit.register(tiled_renderer.close)
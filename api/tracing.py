@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import bisect
+import threading
+
+# --- Environment Variables ---
+TRACING = os.environ.get('TRACING') == '1'
+
+# --- Constants ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# --- Metrics Aggregator ---
+class Metrics:
+    """In-process counters and latency histograms, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, labels=()):
+        key = (name, tuple(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(LATENCY_BUCKETS), 0, 0.0]
+            index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+            if index < len(LATENCY_BUCKETS):
+                histogram[0][index] += 1
+            histogram[1] += 1
+            histogram[2] += seconds
+
+    def add_collector(self, prefix, collect):
+        """Registers a callable returning {name: number}, exported as gauges named prefix_name."""
+        self._collectors.append((prefix, collect))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, ([*h[0]], h[1], h[2])) for key, h in self._histograms.items())
+        for (name, labels), value in counters:
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), (buckets, count, total) in histograms:
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS, buckets):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        for prefix, collect in self._collectors:
+            try:
+                values = collect()
+            except Exception as e:
+                print(f"Metrics collector ላይ ስህተት ({prefix}): {e}")
+                continue
+            for name, value in sorted(values.items()):
+                if isinstance(value, (int, float)):
+                    lines.append(f"{prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+metrics = Metrics()
+
+# --- Spans ---
+_local = threading.local()
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+_NOOP = _NoopSpan()
+
+class _Span:
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        metrics.observe('photo_bot_span_seconds', seconds, (('span', self.name),))
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            entry = {'name': self.name, 'ms': round(seconds * 1000, 2)}
+            entry.update(self.attrs)
+            if exc_type:
+                entry['error'] = exc_type.__name__
+            trace['spans'].append(entry)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+def span(name, **attrs):
+    """Times a block: `with span('render', steps=3): ...`. A shared no-op when tracing is off."""
+    if not TRACING:
+        return _NOOP
+    return _Span(name, attrs)
+
+def record_bytes(direction, endpoint, nbytes):
+    """Counts bytes sent ('out') or received ('in') for an endpoint."""
+    if TRACING and nbytes:
+        metrics.inc('photo_bot_http_bytes_total', (('direction', direction), ('endpoint', endpoint)), nbytes)
+
+def begin_trace(update_type, data=None):
+    if TRACING:
+        _local.trace = {'update_type': update_type, 'data': data, 'start': time.perf_counter(), 'spans': []}
+
+def end_trace():
+    """Emits the current update's spans as one JSON log line."""
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return
+    _local.trace = None
+    seconds = time.perf_counter() - trace.pop('start')
+    labels = (('update_type', trace['update_type']),)
+    metrics.inc('photo_bot_updates_total', labels)
+    metrics.observe('photo_bot_update_seconds', seconds, labels)
+    print(json.dumps(dict(event='trace', total_ms=round(seconds * 1000, 2), **trace), ensure_ascii=False))
@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+SEEN_WINDOW_SIZE = 10000
+
+class SeenWindow:
+    """Remembers the most recent update_ids, using bounded memory."""
+
+    def __init__(self, size=SEEN_WINDOW_SIZE):
+        self.size = size
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, update_id):
+        """Records update_id. Returns False if it was already in the window."""
+        with self._lock:
+            if update_id in self._ids:
+                return False
+            self._ids[update_id] = True
+            if len(self._ids) > self.size:
+                self._ids.popitem(last=False)
+            return True
+
+    def discard(self, update_id):
+        """Forgets update_id, so a redelivery of it is handled again."""
+        with self._lock:
+            self._ids.pop(update_id, None)
+
+def chat_key(update):
+    """The chat an update belongs to; updates of one chat are processed in order."""
+    for field in ('callback_query', 'message', 'my_chat_member', 'edited_message'):
+        if field in update:
+            item = update[field]
+            chat = (item.get('message') or {}).get('chat') if field == 'callback_query' else item.get('chat')
+            if chat and 'id' in chat:
+                return chat['id']
+    return ('update', update.get('update_id'))
+
+class LocalUpdateQueue:
+    """In-process update queue: one update in flight per chat, parallel across chats."""
+
+    def __init__(self, handler, workers=8, seen=None):
+        self.handler = handler
+        self.seen = seen or SeenWindow()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='update')
+        self._chats = {}  # chat key -> deque of updates waiting behind the one in flight
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self.counters = {'enqueued': 0, 'duplicates': 0, 'processed': 0, 'errors': 0}
+
+    def submit(self, update):
+        """Enqueues an update. Returns False if its update_id was seen recently."""
+        update_id = update.get('update_id')
+        if update_id is not None and not self.seen.add(update_id):
+            with self._lock:
+                self.counters['duplicates'] += 1
+            return False
+        key = chat_key(update)
+        with self._lock:
+            self.counters['enqueued'] += 1
+            waiting = self._chats.get(key)
+            if waiting is not None:
+                waiting.append(update)
+                return True
+            self._chats[key] = deque()
+        self._pool.submit(self._drain, key, update)
+        return True
+
+    def _drain(self, key, update):
+        while True:
+            try:
+                self.handler(update)
+                outcome = 'processed'
+            except Exception as e:
+                print(f"Update በማስኬድ ላይ ስህተት ({update.get('update_id')}): {e}")
+                outcome = 'errors'
+            with self._lock:
+                self.counters[outcome] += 1
+                waiting = self._chats[key]
+                if not waiting:
+                    del self._chats[key]
+                    self._idle.notify_all()
+                    return
+                update = waiting.popleft()
+
+    def wait_idle(self, timeout=None):
+        """Blocks until every queued update has been processed. Returns False on timeout."""
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._chats, timeout=timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['busy_chats'] = len(self._chats)
+            stats['waiting'] = sum(len(waiting) for waiting in self._chats.values())
+        return stats
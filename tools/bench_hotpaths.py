@@ -0,0 +1,204 @@
+"""Benchmarks the image-processing and webhook hot paths of the bot.
+
+Usage:
+    python tools/bench_hotpaths.py [--sizes 1MP,4MP,12MP] [--iterations N]
+                                   [--storage sqlite|jsonbin]
+                                   [--save FILE] [--compare FILE]
+
+Groups:
+    filter/<type>       photo_editing.apply_filter() for every filter
+    adjust/<tool>       photo_editing.apply_adjustment() for every tool
+    reapply/<n>         photo_editing.reapply_adjustments() with an n-step session history
+    encode/<profile>    encoder.encode() with each profile, as send_or_edit_photo()
+                        uses it (the report adds the encoded size in KB)
+    webhook/<kind>      tools/bench_updates.json replayed through Flask's test
+                        client against tools/fake_api.py (photo = photo
+                        message, callback = button press, text = the rest)
+                        on the --storage backend; jsonbin runs against the
+                        fake JSONBin in tools/fake_api.py
+
+Each image size runs in a fresh process so its peak RSS is its own. The
+report has p50/p95/p99 latency in ms, throughput in ops/s and peak RSS in
+MB. --save writes the results as a baseline; --compare prints each group's
+p50 change against a saved baseline and flags slowdowns above --threshold.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(TOOLS_DIR, '..', 'api')
+
+SIZES = {'1MP': (1152, 864), '4MP': (2304, 1728), '12MP': (4000, 3000)}
+FILTERS = ('saturate', 'enhance', 'dynamic', 'airy', 'cinematic', 'noir')
+TOOLS = ('brightness', 'contrast', 'saturation', 'warmth', 'shadow')
+HISTORIES = (1, 10, 50)
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+def summarize(samples):
+    return {
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'ops_per_s': len(samples) / sum(samples) if sum(samples) else 0.0,
+        'n': len(samples),
+    }
+
+def timed(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def make_photo(size):
+    from PIL import Image, ImageFilter
+    gradient = Image.linear_gradient('L').resize(size)
+    texture = Image.effect_noise(size, 50).filter(ImageFilter.GaussianBlur(6))
+    base = Image.merge('RGB', (gradient, texture, gradient.transpose(Image.Transpose.ROTATE_180)))
+    return Image.blend(base, Image.effect_mandelbrot(size, (-2, -1.5, 1, 1.5), 60).convert('RGB'), 0.3)
+
+def history(n):
+    """An n-step session history that does not collapse (tools alternate)."""
+    return [{'tool': TOOLS[i % len(TOOLS)], 'value': 1 if i % 3 else -1} for i in range(n)]
+
+def run_size(size_name, iterations, webhook_rounds, storage_backend='sqlite'):
+    """Runs every group for one image size. Meant to run in its own process."""
+    workdir = tempfile.mkdtemp(prefix='photo-bench-')
+    os.environ.update({
+        'TELEGRAM_TOKEN': 'bench', 'ADMIN_ID': '1', 'STORAGE_BACKEND': storage_backend,
+        'SQLITE_PATH': os.path.join(workdir, 'bench.db'), 'IMAGE_CACHE_DISK_DIR': '',
+        'JSONBIN_API_KEY': 'bench', 'JSONBIN_BIN_ID': 'bench',
+    })
+    sys.path[:0] = [API_DIR, TOOLS_DIR]
+    import index
+    import http_client
+    import photo_editing
+    from encoder import encoder
+    from sessions import get_session
+    from fake_api import FakeApiServer
+
+    photo = make_photo(SIZES[size_name])
+    results = {}
+    for filter_type in FILTERS:
+        results[f"filter/{filter_type}"] = summarize(timed(lambda: photo_editing.apply_filter(photo, filter_type), iterations))
+    for tool in TOOLS:
+        results[f"adjust/{tool}"] = summarize(timed(lambda: photo_editing.apply_adjustment(photo, tool, 1), iterations))
+    for n in HISTORIES:
+        steps = history(n)
+        results[f"reapply/{n}"] = summarize(timed(lambda: photo_editing.reapply_adjustments(photo, steps), iterations))
+    for profile in ('preview', 'final'):
+        results[f"encode/{profile}"] = summarize(timed(lambda: encoder.encode(photo, profile), iterations))
+        results[f"encode/{profile}"]['kb'] = encoder.encode(photo, profile)[1]['bytes'] / 1024
+
+    buffer = io.BytesIO()
+    photo.save(buffer, format='JPEG', quality=90)
+    with open(os.path.join(TOOLS_DIR, 'bench_updates.json')) as f:
+        recorded = f.read()
+    with FakeApiServer(photo_bytes=buffer.getvalue()) as server:
+        server.install(http_client)
+        client = index.app.test_client()
+        storage = index.get_storage()
+        samples = {'photo': [], 'callback': [], 'text': []}
+        start = time.perf_counter()
+        for round_number in range(webhook_rounds):
+            user_id = 100000 + round_number
+            # Fresh file_ids every round, so the photo path is never a cache hit.
+            updates = json.loads(recorded.replace('"USER_ID"', str(user_id)).replace('FILE_ID', f"bench-{size_name}-{round_number}"))
+            for update in updates:
+                # Unique update_ids, or the webhook drops later rounds as redeliveries.
+                update['update_id'] += round_number * len(updates)
+                if 'callback_query' in update:
+                    session = get_session(str(user_id)) or {}
+                    update['callback_query']['message']['message_id'] = session.get('message_id', 1)
+                    kind = 'callback'
+                else:
+                    kind = 'photo' if 'photo' in update['message'] else 'text'
+                if kind == 'photo':
+                    storage.add_credits(str(user_id), 1)
+                t0 = time.perf_counter()
+                response = client.post('/', json=update)
+                samples[kind].append(time.perf_counter() - t0)
+                assert response.status_code == 200, response.data
+        elapsed = time.perf_counter() - start
+        for kind, kind_samples in samples.items():
+            results[f"webhook/{kind}"] = summarize(kind_samples)
+        results['webhook/all'] = dict(summarize(sum(samples.values(), [])), ops_per_s=sum(len(v) for v in samples.values()) / elapsed)
+
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    for group in results.values():
+        group['peak_rss_mb'] = peak_mb
+    return results
+
+def _worker(size_name, iterations, webhook_rounds, storage_backend, queue):
+    queue.put(run_size(size_name, iterations, webhook_rounds, storage_backend))
+
+def print_report(results, baseline=None, threshold=0.10):
+    header = f"{'size':<6}{'group':<22}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ops/s':>9}{'RSS MB':>8}"
+    if baseline:
+        header += f"{'vs base':>10}"
+    print(header)
+    regressions = 0
+    for size_name, groups in results.items():
+        for group, stats in groups.items():
+            line = (f"{size_name:<6}{group:<22}{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}"
+                    f"{stats['p99_ms']:>9.1f}{stats['ops_per_s']:>9.1f}{stats['peak_rss_mb']:>8.0f}")
+            base = (baseline or {}).get(size_name, {}).get(group)
+            if base and base['p50_ms']:
+                change = stats['p50_ms'] / base['p50_ms'] - 1
+                flag = '  SLOWER' if change > threshold else ''
+                regressions += bool(flag)
+                line += f"{change:>+9.0%}{flag}"
+            if 'kb' in stats:
+                line += f"  {stats['kb']:.0f} KB"
+            print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1MP,4MP,12MP')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--webhook-rounds', type=int, default=5)
+    parser.add_argument('--storage', choices=('sqlite', 'jsonbin'), default='sqlite', help="storage backend for the webhook groups")
+    parser.add_argument('--save', help="write results to this baseline file")
+    parser.add_argument('--compare', help="compare against this baseline file")
+    parser.add_argument('--threshold', type=float, default=0.10, help="p50 slowdown flagged as a regression")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for size_name in args.sizes.split(','):
+        queue = context.Queue()
+        process = context.Process(target=_worker, args=(size_name, args.iterations, args.webhook_rounds, args.storage, queue))
+        process.start()
+        results[size_name] = queue.get()
+        process.join()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        baseline = saved['results']
+        if saved.get('storage', 'sqlite') != args.storage:
+            print(f"warning: baseline used {saved.get('storage', 'sqlite')} storage, this run {args.storage}")
+    print(f"storage: {args.storage}")
+    regressions = print_report(results, baseline, args.threshold)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'created_at': time.time(), 'python': sys.version.split()[0], 'storage': args.storage, 'results': results}, f, indent=2)
+    if baseline and regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
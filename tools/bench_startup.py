@@ -0,0 +1,100 @@
+"""Measures cold-start cost: importing api/index.py and the first request after it.
+
+Usage: python tools/bench_startup.py [--repeat N] [--updates text,callback,photo]
+
+Every run is a fresh process, as on a serverless cold start. Each one
+times `import index`, then posts one update of the given kind through
+Flask's test client against tools/fake_api.py and times that first
+request and an identical second one. The report has the median of
+--repeat runs in ms and whether Pillow was loaded after the import and
+after the first request; text updates should never load it.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(TOOLS_DIR, '..', 'api')
+
+USER_ID = 4242
+UPDATES = {
+    'text': {'message': {'message_id': 1, 'from': {'id': USER_ID, 'first_name': 'Bench'}, 'chat': {'id': USER_ID, 'type': 'private'}, 'text': '/start'}},
+    'callback': {'callback_query': {'id': 'cb', 'from': {'id': USER_ID}, 'message': {'message_id': 1, 'chat': {'id': USER_ID, 'type': 'private'}}, 'data': 'mycredit'}},
+    'photo': {'message': {'message_id': 1, 'from': {'id': USER_ID, 'first_name': 'Bench'}, 'chat': {'id': USER_ID, 'type': 'private'}, 'photo': [{'file_id': 'bench-photo', 'width': 1600, 'height': 1200}]}},
+}
+
+def _environ(db_path):
+    os.environ.update({
+        'TELEGRAM_TOKEN': 'bench', 'ADMIN_ID': '1', 'STORAGE_BACKEND': 'sqlite',
+        'SQLITE_PATH': db_path, 'IMAGE_CACHE_DISK_DIR': '',
+    })
+    sys.path[:0] = [API_DIR, TOOLS_DIR]
+
+def _seed(db_path):
+    """Creates the bench user in its own process, so the measured ones start cold."""
+    _environ(db_path)
+    from storage import get_storage
+    get_storage().create_user(str(USER_ID), {'credits': 1000, 'invited_by': None, 'add_task': {}})
+
+def _pillow_loaded():
+    return 'PIL.Image' in sys.modules
+
+def _run(kind, db_path, photo_bytes, queue):
+    _environ(db_path)
+    start = time.perf_counter()
+    import index
+    result = {'import_ms': (time.perf_counter() - start) * 1000, 'pillow_after_import': _pillow_loaded()}
+
+    import http_client
+    from fake_api import FakeApiServer
+    with FakeApiServer(photo_bytes=photo_bytes) as server:
+        server.install(http_client)
+        client = index.app.test_client()
+        for attempt, name in enumerate(('first_ms', 'second_ms')):
+            update = dict(UPDATES[kind], update_id=attempt + 1)
+            start = time.perf_counter()
+            response = client.post('/', json=update)
+            result[name] = (time.perf_counter() - start) * 1000
+            assert response.status_code == 200, response.data
+            if attempt == 0:
+                result['pillow_after_first'] = _pillow_loaded()
+    queue.put(result)
+
+def make_photo_bytes():
+    import io
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.linear_gradient('L').resize((1600, 1200)).convert('RGB').save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--updates', default='text,callback,photo')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    photo_bytes = make_photo_bytes()
+    print(f"{'update':<10}{'import ms':>11}{'first ms':>10}{'second ms':>11}{'PIL@import':>12}{'PIL@first':>11}")
+    for kind in args.updates.split(','):
+        runs = []
+        for _ in range(args.repeat):
+            db_path = os.path.join(tempfile.mkdtemp(prefix='photo-startup-'), 'bench.db')
+            seed = context.Process(target=_seed, args=(db_path,))
+            seed.start()
+            seed.join()
+            queue = context.Queue()
+            process = context.Process(target=_run, args=(kind, db_path, photo_bytes, queue))
+            process.start()
+            runs.append(queue.get())
+            process.join()
+        median = {name: statistics.median(run[name] for run in runs) for name in ('import_ms', 'first_ms', 'second_ms')}
+        print(f"{kind:<10}{median['import_ms']:>11.1f}{median['first_ms']:>10.1f}{median['second_ms']:>11.1f}"
+              f"{str(any(run['pillow_after_import'] for run in runs)):>12}{str(any(run['pillow_after_first'] for run in runs)):>11}")
+
+if __name__ == '__main__':
+    main()
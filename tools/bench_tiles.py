@@ -0,0 +1,58 @@
+"""Measures how tiled rendering scales with the number of pool processes.
+
+Usage: python tools/bench_tiles.py [--processes 2,4,8] [--sizes 4MP,12MP] [--repeat N]
+
+For each image size and filter, prints the median time of an in-process
+render and of a TiledRenderer with each process count, the speedup over the
+in-process render, and whether the tiled output is pixel-identical to it.
+The pool is warmed up before timing, as it would be in a long-lived worker.
+Colour-only programs (cinematic, noir) are rendered in-process by the bot;
+they are timed here to show why.
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+from PIL import ImageChops
+from color_engine import compile_program
+from tiled_render import TiledRenderer
+from bench_color_engine import SIZES, make_test_image, median_time
+
+PROGRAMS = ('enhance', 'dynamic', 'cinematic', 'noir')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', default=','.join(str(n) for n in (2, 4, 8) if n <= (os.cpu_count() or 1)) or '2')
+    parser.add_argument('--sizes', default='4MP,12MP')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    counts = [int(n) for n in args.processes.split(',')]
+
+    print(f"cpu_count={os.cpu_count()}")
+    header = f"{'size':<6}{'program':<12}{'1 proc ms':>11}"
+    for n in counts:
+        header += f"{f'{n} procs ms':>13}{'speedup':>9}"
+    print(header + f"{'identical':>11}")
+
+    renderers = {n: TiledRenderer(processes=n, min_pixels=1) for n in counts}
+    try:
+        for size_name in args.sizes.split(','):
+            image = make_test_image(SIZES[size_name])
+            for name in PROGRAMS:
+                program = compile_program((), name)
+                expected = program.render(image)
+                single = median_time(lambda: program.render(image), args.repeat)
+                line = f"{size_name:<6}{name:<12}{single * 1000:>11.1f}"
+                identical = True
+                for n, renderer in renderers.items():
+                    identical &= ImageChops.difference(renderer.render_tiled(program, image), expected).getbbox() is None
+                    tiled = median_time(lambda: renderer.render_tiled(program, image), args.repeat)
+                    line += f"{tiled * 1000:>13.1f}{single / tiled:>8.2f}x"
+                print(line + f"{str(identical):>11}")
+    finally:
+        for renderer in renderers.values():
+            renderer.close()
+
+if __name__ == '__main__':
+    main()
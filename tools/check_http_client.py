@@ -0,0 +1,100 @@
+"""Checks http_client's retry behaviour against tools/fake_api.py, offline.
+
+Usage: python tools/check_http_client.py
+
+Each case scripts failures on the fake server, sends one request through
+http_client.request() and checks how many attempts reached the server and
+how long the client chose to wait between them. The waits are recorded
+instead of slept. Prints one line per case and exits non-zero if any fail.
+"""
+import os
+import sys
+import types
+import socket
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(TOOLS_DIR, '..', 'api'), TOOLS_DIR]
+import requests
+import http_client
+from fake_api import FakeApiServer, DISCONNECT
+
+SLEEPS = []
+# Record http_client's waits instead of sleeping through them.
+http_client.time = types.SimpleNamespace(sleep=SLEEPS.append)
+
+def _backoff_bounds(attempt):
+    full = min(http_client.BACKOFF_MAX, http_client.BACKOFF_BASE * 2 ** attempt)
+    return full / 2, full
+
+def _closed_url():
+    """A local URL nothing listens on, so connecting is refused."""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+def run_case(server, http_method, endpoint, retries=3, **kwargs):
+    """Sends one request; returns (status or exception name, attempts, sleeps)."""
+    del SLEEPS[:]
+    before = server.count(endpoint)
+    try:
+        outcome = http_client.request(http_method, http_client.telegram_url(endpoint), endpoint=endpoint, retries=retries, **kwargs).status_code
+    except requests.exceptions.RequestException as e:
+        outcome = type(e).__name__
+    return outcome, server.count(endpoint) - before, list(SLEEPS)
+
+def main():
+    failures = 0
+    with FakeApiServer() as server:
+        server.install(http_client)
+        checks = []
+
+        server.fail_next('sendMessage', 500, times=2)
+        outcome, attempts, sleeps = run_case(server, 'POST', 'sendMessage')
+        checks.append(("5xx is retried with backoff", outcome == 200 and attempts == 3 and len(sleeps) == 2
+                       and all(low <= delay <= high for delay, (low, high) in zip(sleeps, map(_backoff_bounds, range(2))))))
+
+        server.fail_next('sendMessage', 429, retry_after=2)
+        outcome, attempts, sleeps = run_case(server, 'POST', 'sendMessage')
+        checks.append(("429 waits retry_after", outcome == 200 and attempts == 2 and sleeps == [2.0]))
+
+        server.fail_next('sendMessage', 429, retry_after=http_client.MAX_RETRY_AFTER + 1)
+        outcome, attempts, sleeps = run_case(server, 'POST', 'sendMessage')
+        checks.append(("long retry_after is returned", outcome == 429 and attempts == 1 and sleeps == []))
+
+        server.fail_next('sendMessage', 503, times=3)
+        outcome, attempts, sleeps = run_case(server, 'POST', 'sendMessage', retries=2)
+        checks.append(("gives up after the last retry", outcome == 503 and attempts == 3 and len(sleeps) == 2))
+
+        server.fail_next('sendMessage', 400)
+        outcome, attempts, sleeps = run_case(server, 'POST', 'sendMessage')
+        checks.append(("4xx is not retried", outcome == 400 and attempts == 1 and sleeps == []))
+
+        server.fail_next('sendMessage', DISCONNECT)
+        outcome, attempts, sleeps = run_case(server, 'POST', 'sendMessage')
+        checks.append(("POST dropped after sending is not retried", outcome == 'ConnectionError' and attempts == 1 and sleeps == []))
+
+        server.fail_next('getFile', DISCONNECT)
+        outcome, attempts, sleeps = run_case(server, 'GET', 'getFile')
+        checks.append(("GET dropped after sending is retried", outcome == 200 and attempts == 2 and len(sleeps) == 1))
+
+        http_client.TELEGRAM_API_URL = _closed_url()
+        outcome, _, sleeps = run_case(server, 'POST', 'sendMessage', retries=2)
+        checks.append(("POST refused connection is retried", outcome == 'ConnectionError' and len(sleeps) == 2))
+        server.install(http_client)
+
+        server.latency = 0.3
+        outcome, attempts, sleeps = run_case(server, 'POST', 'sendMessage', timeout=(1, 0.1))
+        checks.append(("POST read timeout is not retried", outcome == 'ReadTimeout' and attempts == 1 and sleeps == []))
+
+        outcome, attempts, sleeps = run_case(server, 'GET', 'getFile', retries=2, timeout=(1, 0.1))
+        checks.append(("GET read timeout is retried", outcome == 'ReadTimeout' and attempts == 3 and len(sleeps) == 2))
+        server.latency = 0.0
+
+        for name, ok in checks:
+            failures += not ok
+            print(f"{'ok' if ok else 'FAIL':<6}{name}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Checks the storage backends' atomic operations and the session history, offline.
+
+Usage: python tools/check_storage.py
+
+Runs the same cases against SQLiteStorage (a temporary file) and
+JsonBinStorage (the fake JSONBin in tools/fake_api.py): repeated ledger
+keys, refunds and retried charges, concurrent add_task_members and
+add_credits, the record compare-and-set and conditional expiry, the JSONBin
+stats migration and empty record kinds, and push_step/undo_step sequences.
+Prints one line per case and exits non-zero if any fail.
+"""
+import os
+import sys
+import tempfile
+import threading
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(TOOLS_DIR, '..', 'api'), TOOLS_DIR]
+os.environ.update({'JSONBIN_API_KEY': 'check', 'JSONBIN_BIN_ID': 'check', 'TELEGRAM_TOKEN': 'check'})
+import http_client
+import sessions
+import storage as storage_module
+from photo_editing import charge
+from fake_api import FakeApiServer
+
+THREADS = 8
+
+def _concurrently(fn, count=THREADS):
+    """Runs fn(i) on count threads at once and returns the results in order."""
+    results = [None] * count
+    barrier = threading.Barrier(count)
+
+    def target(i):
+        barrier.wait()
+        results[i] = fn(i)
+
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def check_ledger(storage):
+    checks = []
+    storage.create_user('1', {'credits': 5})
+    first, again = storage.add_credits('1', 2, key='award:1'), storage.add_credits('1', 2, key='award:1')
+    checks.append(("a repeated key is applied once", first == (7, True) and again == (7, False)
+                   and storage.get_user('1')['credits'] == 7))
+    checks.append(("a refused change is not applied", storage.add_credits('1', -100, min_balance=0) == (None, False)
+                   and storage.add_credits('missing', 1) == (None, False) and storage.get_user('1')['credits'] == 7))
+
+    key, balance = charge(storage, '1', 1, 'photo:1')
+    repeat_key, _ = charge(storage, '1', 1, 'photo:1')
+    checks.append(("a charged key stops the retry", key == 'photo:1' and balance == 6 and repeat_key is None))
+    storage.add_credits('1', 1, key='photo:1:refund')
+    retry_key, balance = charge(storage, '1', 1, 'photo:1')
+    checks.append(("a refunded charge is charged again", retry_key == 'photo:1:2' and balance == 6
+                   and storage.has_ledger_key('photo:1:2') and not storage.has_ledger_key('photo:1:3')))
+
+    storage.create_user('2', {'credits': 0})
+    applied = _concurrently(lambda i: storage.add_credits('2', 3, key='award:2')[1])
+    checks.append(("concurrent calls with one key apply it once", applied.count(True) == 1
+                   and storage.get_user('2')['credits'] == 3))
+    applied = _concurrently(lambda i: storage.add_credits('2', -1, min_balance=0)[1])
+    checks.append(("concurrent charges stop at min_balance", applied.count(True) == 3
+                   and storage.get_user('2')['credits'] == 0))
+    stats = storage.user_stats(0)
+    checks.append(("credit totals follow every change", stats['users'] == 2 and stats['credits'] == 6))
+    return checks
+
+def check_add_task(storage):
+    storage.create_user('3', {'credits': 0, 'add_task': {'id': 't1', 'group_id': -100, 'added_count': 0, 'completed': False}})
+    results = _concurrently(lambda i: storage.add_task_members('3', -100, 2, 10))
+    task = storage.get_user('3')['add_task']
+    return [
+        ("concurrent joins complete the task once", sum(completed for _, completed in results) == 1
+         and task['added_count'] == 10 and task['completed']),
+        ("a completed task leaves the index", storage.find_users('task_group', -100) == []),
+        ("a completed task takes no more members", storage.add_task_members('3', -100, 1, 10) == (None, False)),
+    ]
+
+def check_records(storage):
+    checks = []
+    storage.put_records('session', {'old': {'expires_at': 0}, 'live': {'expires_at': 2e9}, 'gone': {'expires_at': 0}})
+    # The sweep saw 'old' expired, then another update started a new session under that key.
+    storage.put_record('session', 'old', {'expires_at': 2e9})
+    deleted = storage.delete_expired('session', 1e9)
+    checks.append(("delete_expired spares a rewritten record", deleted == 1
+                   and sorted(key for key, _ in storage.iter_records('session')) == ['live', 'old']))
+    checks.append(("delete_expired with keys is limited to them", storage.delete_expired('session', 3e9, keys=['live']) == 1
+                   and [key for key, _ in storage.iter_records('session')] == ['old']))
+
+    storage.put_record('job', 'j', {'runner': None, 'n': 0})
+    taken = _concurrently(lambda i: storage.update_record_if('job', 'j', 'runner', None, {'runner': f"r{i}", 'n': i}))
+    holder = storage.get_record('job', 'j')['runner']
+    checks.append(("update_record_if lets one writer win", taken.count(True) == 1 and holder == f"r{taken.index(True)}"))
+    checks.append(("update_record_if refuses a stale token", not storage.update_record_if('job', 'j', 'runner', None, {})
+                   and not storage.update_record_if('job', 'missing', 'runner', None, {})))
+    checks.append(("create_record keeps the first value", storage.create_record('claim', 'a', {'n': 1})
+                   and not storage.create_record('claim', 'a', {'n': 2}) and storage.get_record('claim', 'a') == {'n': 1}))
+    return checks
+
+def check_jsonbin_document(storage, server):
+    server.jsonbin_document = {'users': {'10': {'credits': 3}, '11': {'credits': 4}}}
+    storage.refresh()
+    storage.add_credits('10', 5)
+    totals = storage.user_stats(0)
+    for kind in ('presets:10', 'album', 'ledger'):
+        storage.get_record(kind, 'x')
+        storage.iter_records(kind)
+        storage.delete_expired(kind, 1e9)
+    storage.touch_user('10', 1)
+    return [
+        ("missing stats are computed before the change", totals['users'] == 2 and totals['credits'] == 12),
+        ("reads do not add empty record kinds", not server.jsonbin_document.get('records')),
+    ]
+
+def check_history():
+    session = sessions.new_session('file', 1)
+    for tool, value in (('brightness', 1), ('contrast', 1), ('contrast', -1), ('brightness', 1)):
+        sessions.push_step(session, tool, value)
+    collapsed = sessions.session_steps(session) == (('brightness', 2),)
+    sessions.undo_step(session)
+    sessions.undo_step(session)
+    after_undo = sessions.session_steps(session) == (('brightness', 1), ('contrast', 1))
+    while sessions.undo_step(session):
+        pass
+    emptied = session['steps'] == [] and session['undo'] == []
+    for _ in range(sessions.UNDO_DEPTH + 5):
+        sessions.push_step(session, 'contrast', 1)
+    return [
+        ("steps collapse to their net values", collapsed),
+        ("undo restores the previous steps", after_undo),
+        ("undoing everything leaves no steps", emptied),
+        ("repeated steps stay one step", session['steps'] == [['contrast', sessions.UNDO_DEPTH + 5]]),
+        ("the undo history is bounded", len(session['undo']) == sessions.UNDO_DEPTH),
+    ]
+
+def main():
+    failures = 0
+    results = []
+    with FakeApiServer() as server:
+        server.install(http_client)
+        backends = {
+            'sqlite': storage_module.SQLiteStorage(os.path.join(tempfile.mkdtemp(prefix='photo-check-'), 'check.db')),
+            'jsonbin': storage_module.JsonBinStorage(),
+        }
+        for backend, storage in backends.items():
+            for name, ok in check_ledger(storage) + check_add_task(storage) + check_records(storage):
+                results.append((f"{backend}: {name}", ok))
+        for name, ok in check_jsonbin_document(backends['jsonbin'], server):
+            results.append((f"jsonbin: {name}", ok))
+    results += [(f"sessions: {name}", ok) for name, ok in check_history()]
+
+    for name, ok in results:
+        failures += not ok
+        print(f"{'ok' if ok else 'FAIL':<6}{name}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
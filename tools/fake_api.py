@@ -0,0 +1,181 @@
+"""Local fake of the Telegram Bot API and JSONBin, for offline runs.
+
+    from fake_api import FakeApiServer
+    with FakeApiServer() as server:
+        server.install(http_client)         # point api/http_client.py at it
+        server.fail_next('sendMessage', 429, retry_after=1)
+        server.fail_next('sendPhoto', DISCONNECT)  # close without answering
+        ...
+        server.calls                        # [(http_method, endpoint, body_bytes), ...]
+
+Telegram methods answer {'ok': true, ...} with plausible results (getFile,
+sendPhoto, editMessageMedia and sendMediaGroup return photo file_ids);
+/file/bot<token>/<path> serves server.photo_bytes; /v3/b/<bin> keeps one
+JSON document in memory. Run it directly to serve on a fixed port.
+"""
+import io
+import json
+import re
+import threading
+import itertools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DISCONNECT = 'disconnect'  # fail_next() status: read the request, then close without a response
+
+def _default_photo():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.linear_gradient('L').resize((1600, 1200)).convert('RGB').save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+class FakeApiServer:
+    def __init__(self, host='127.0.0.1', port=0, photo_bytes=None):
+        self.photo_bytes = photo_bytes if photo_bytes is not None else _default_photo()
+        self.jsonbin_document = {'users': {}}
+        self.calls = []
+        self.latency = 0.0  # Seconds added to every response
+        self._failures = {}
+        self._ids = itertools.count(1000)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # --- Lifecycle ---
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def install(self, http_client):
+        """Points an imported http_client module at this server."""
+        http_client.TELEGRAM_API_URL = self.url
+        http_client.JSONBIN_API_URL = self.url
+
+    # --- Scripting ---
+    def fail_next(self, endpoint, status, retry_after=None, times=1):
+        """Makes the next `times` calls to endpoint (a Telegram method, 'file' or 'jsonbin') fail."""
+        with self._lock:
+            self._failures.setdefault(endpoint, []).extend([(status, retry_after)] * times)
+
+    def count(self, endpoint):
+        with self._lock:
+            return sum(1 for _, name, _ in self.calls if name == endpoint)
+
+    def _next_failure(self, endpoint):
+        with self._lock:
+            queue = self._failures.get(endpoint)
+            return queue.pop(0) if queue else None
+
+    def _next_id(self):
+        with self._lock:
+            return next(self._ids)
+
+    # --- Request handling ---
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, like the real APIs
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def _send(self, status, payload=None, raw=None, content_type='application/json'):
+                body = raw if raw is not None else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The client gave up (e.g. a read timeout under test)
+
+            def _dispatch(self, http_method):
+                body = self._body()
+                path = self.path.split('?')[0]
+                if path.startswith('/v3/b/'):
+                    endpoint = 'jsonbin'
+                elif path.startswith('/file/'):
+                    endpoint = 'file'
+                else:
+                    match = re.match(r'^/bot[^/]*/(\w+)$', path)
+                    endpoint = match.group(1) if match else path
+                with server._lock:
+                    server.calls.append((http_method, endpoint, body))
+                # Calls are recorded on arrival, so a client that timed out is still counted.
+                if server.latency:
+                    threading.Event().wait(server.latency)
+                failure = server._next_failure(endpoint)
+                if failure:
+                    status, retry_after = failure
+                    if status == DISCONNECT:
+                        self.close_connection = True
+                        return
+                    payload = {'ok': False, 'error_code': status, 'description': f"Fake error {status}"}
+                    if retry_after is not None:
+                        payload['parameters'] = {'retry_after': retry_after}
+                    return self._send(status, payload)
+                if endpoint == 'jsonbin':
+                    if http_method == 'PUT':
+                        server.jsonbin_document = json.loads(body or b'{}')
+                        return self._send(200, {'record': server.jsonbin_document})
+                    return self._send(200, server.jsonbin_document)
+                if endpoint == 'file':
+                    return self._send(200, raw=server.photo_bytes, content_type='image/jpeg')
+                return self._send(200, {'ok': True, 'result': server._result(endpoint, body)})
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def do_PUT(self):
+                self._dispatch('PUT')
+
+        return Handler
+
+    def _result(self, endpoint, body):
+        message_id = self._next_id()
+        photo = [{'file_id': f"fake-photo-{message_id}", 'width': 1280, 'height': 960}]
+        if endpoint == 'getFile':
+            return {'file_id': 'fake', 'file_path': f"photos/file_{message_id}.jpg"}
+        elif endpoint in ('sendPhoto', 'editMessageMedia', 'editMessageCaption'):
+            return {'message_id': message_id, 'chat': {'id': 0}, 'photo': photo}
+        elif endpoint == 'sendMediaGroup':
+            count = max(1, body.count(b'"type"'))
+            return [{'message_id': message_id + i, 'photo': photo} for i in range(count)]
+        elif endpoint == 'sendMessage':
+            return {'message_id': message_id, 'chat': {'id': 0}}
+        return True
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve a fake Telegram/JSONBin API.")
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+    server = FakeApiServer(port=args.port)
+    print(f"Fake Telegram/JSONBin API on {server.url} (set TELEGRAM_API_URL and JSONBIN_API_URL)")
+    server._httpd.serve_forever()